@@ -0,0 +1,155 @@
+""" The application, started by main.py """
+
+import sys
+import qdarkstyle
+import cProfile
+import time
+import argparse
+
+from PyQt5.QtWidgets import QSystemTrayIcon, QApplication, QMessageBox
+from PyQt5.QtGui import QIcon
+from PyQt5.QtCore import QSize, QTimer
+
+from communications import udp_conn, database
+from controller import gamepad as gp
+from mainwindow import window_main as wm
+from utils import event
+from settings import settings as cfg
+from camera import video_manager
+
+APP_RESTART_CODE = -2500
+
+class MarsRoverApp(QApplication):
+    def __init__(self):
+        super().__init__(sys.argv)
+        cfg.SETTINGSEVENT.addListener(self, self.onSettingsChanged)
+        cfg.RESTARTEVENT.addListener(self, self.onCheckShouldRestart)
+        self.setWindowIcon(self.loadAppIcon())
+        self.loadSettings(cfg.SETTINGS)
+
+    def exec_(self):
+        v = super().exec_() # Returns 'return code'...
+        gp.shutdownGamepad()
+        udp_conn.disconnectFromRoverServer()
+        database.shutdownDatabase()
+        return v
+
+    def onSettingsChanged(self, name, params):
+        self.loadSettings(params)
+
+    def onCheckShouldRestart(self, name, params):
+        """
+        Triggered by the settings GUI, params = settings GUI window class.
+        """
+        msg = QMessageBox(QMessageBox.Warning, "Restart Required!",
+                          "The application has to be restarted in order to apply the desired changes, would you like to restart now?",
+                          QMessageBox.Yes | QMessageBox.No)
+        if msg.exec_() == QMessageBox.Yes:
+            params.saveSettings()  # Save state first.
+            params.close()
+            self.exit(APP_RESTART_CODE)
+
+    # Configuration for application, specifically for stylesheet. Dark Mode should overwrite all other settings.
+    def loadSettings(self, config):
+        darkMode = config.get("main", "stylesheet")
+        self.setStyleSheet(qdarkstyle.load_stylesheet_pyqt5(
+        )) if darkMode == "True" else self.setStyleSheet("")
+
+    def loadAppIcon(self):
+        """Load application default icon, for all windows + taskbar"""
+        app_icon = QIcon()
+        app_icon.addFile('images/logo_16.png', QSize(16, 16))
+        app_icon.addFile('images/logo_24.png', QSize(24, 24))
+        app_icon.addFile('images/logo_32.png', QSize(32, 32))
+        app_icon.addFile('images/logo_48.png', QSize(48, 48))
+        app_icon.addFile('images/logo_256.png', QSize(256, 256))
+        app_icon.addFile('images/logo.png', QSize(512, 512))
+        return app_icon
+
+def parseArguments():
+    """
+    Optional arguments for capturing or replaying rover telemetry + gamepad input, Qt arguments are left alone.
+    """
+    parser = argparse.ArgumentParser(description="Mission Control")
+    parser.add_argument("--capture", help="Append every raw telemetry datagram to this capture file.")
+    parser.add_argument("--replay", help="Replay this capture file instead of listening to the rover.")
+    parser.add_argument("--replay-speed", type=float, default=1.0, help="Replay speed multiplier, 0 replays as fast as possible.")
+    parser.add_argument("--gamepad-record", help="Record the raw gamepad input to this file.")
+    parser.add_argument("--gamepad-replay", help="Replay this gamepad recording instead of reading the physical controller.")
+    parser.add_argument("--gamepad-replay-speed", type=float, default=1.0, help="Gamepad replay speed multiplier, 0 replays one event per send.")
+    parser.add_argument("--report", type=float, default=0, help="Print telemetry ingest, DB writer + gamepad statistics every X sec., useful for soak tests.")
+    args, _ = parser.parse_known_args()
+    return args
+
+class StatisticsReport():
+    """
+    Prints station-side counters for soak tests, pair with the load generator in rover_server.py.
+    """
+    def __init__(self, interval):
+        self.lastTime = time.time()
+        self.lastPackets = 0
+        self.timer = QTimer()
+        self.timer.timeout.connect(self.report)
+        self.timer.start(int(interval * 1000))
+
+    def report(self):
+        now = time.time()
+        ingest = udp_conn.ROVERSERVER.getIngestStatistics()
+        writer = database.WRITER.getStatistics() if database.WRITER else {}
+        pool = database.getPoolStatistics()
+        outbound = udp_conn.ROVERSERVER.getOutboundStatistics()
+        critical, stream = outbound["critical"], outbound["stream"]
+        link = udp_conn.ROVERSERVER.lastLinkStatistics
+        line = ("Received {:.1f} packets/s, {:.1f} per wakeup (max {}), {} malformed, {} merged | loss {:.1f}% | DB queue {}, dropped {}, flush {:.1f} ms | pool {}/{} checked out, wait {:.1f} ms (max {:.1f}) | critical sent {}, age {:.1f} ms (max {:.1f}) | stream sent {}, superseded {}, age {:.1f} ms (max {:.1f})".format(
+            (ingest["packets"] - self.lastPackets) / (now - self.lastTime), ingest["average"], ingest["max"], ingest["malformed"], ingest["merged"],
+            link["loss"], writer.get("depth", 0), writer.get("dropped", 0), writer.get("lastFlush", 0.0) * 1000,
+            pool["checkedOut"], pool["size"], pool["averageWait"] * 1000, pool["maxWait"] * 1000,
+            critical["sent"], critical["lastAge"] * 1000, critical["maxAge"] * 1000,
+            stream["sent"], stream["superseded"], stream["lastAge"] * 1000, stream["maxAge"] * 1000))
+        if gp.GAMEPAD:
+            send, refresh = gp.GAMEPAD.getSendStatistics(), gp.GAMEPAD.getRefreshStatistics()
+            line += " | gamepad sent {}, jitter {:.2f} ms (max {:.2f}), refresh {:.1f} ms (max {:.1f}, {})".format(
+                send["sent"], send["jitter"] * 1000, send["maxJitter"] * 1000,
+                refresh["last"] * 1000, refresh["max"] * 1000, "hotplug" if refresh["hotplug"] else "polled")
+        print(line)
+        self.lastTime, self.lastPackets = now, ingest["packets"]
+
+def run():
+    """
+    Run the app until it exits without asking for a restart, returns the exit code.
+    """
+    #pr = cProfile.Profile()
+    #pr.enable()
+    #pr.disable()
+    #pr.print_stats(sort='time')
+
+    args = parseArguments()
+    code = APP_RESTART_CODE
+    cfg.loadSettings()    
+    while code == APP_RESTART_CODE:
+        database.loadDatabase()
+        app = MarsRoverApp()
+        roverServer = udp_conn.connectToRoverServer()
+        if args.capture:
+            roverServer.startCapture(args.capture)
+        if args.replay:
+            roverServer.startReplay(args.replay, args.replay_speed)
+        gamepad = gp.loadGamepad()
+        if args.gamepad_record:
+            gamepad.startRecording(args.gamepad_record)
+        if args.gamepad_replay:
+            gamepad.startReplay(args.gamepad_replay, args.gamepad_replay_speed)
+        video_manager.load()
+        mainwnd = wm.loadMainWindow()
+        report = StatisticsReport(args.report) if args.report > 0 else None
+        code = app.exec_()
+        mainwnd.close()
+        app = None
+        mainwnd = None
+        report = None
+        if code == APP_RESTART_CODE:
+            cfg.SETTINGSEVENT.clearListeners()
+            cfg.RESTARTEVENT.clearListeners()
+            print("Restarting App!")
+            time.sleep(1 / 2)            
+    return code
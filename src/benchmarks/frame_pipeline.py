@@ -0,0 +1,112 @@
+"""
+Camera frame pipeline benchmark, allocating vs pooled buffers.
+
+Decodes a clip (a generated MJPG clip by default) and converts every frame like the camera workers do,
+once allocating new arrays per frame and once through the reused FrameConverter + frame pool buffers.
+Reports the time, the memory allocated per frame in steady state (after the warmup frames) and the GC runs.
+Run from the src folder: python benchmarks/frame_pipeline.py
+"""
+
+import os
+import gc
+import sys
+import time
+import argparse
+import tempfile
+import tracemalloc
+
+import cv2
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "package"))
+
+from camera import video_process as vp
+
+POOL_SIZE = 3 # Same as THREADING_FRAME_POOL.
+
+def createClip(path, frames, width, height):
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc('M','J','P','G'), 30, (width, height))
+    frame = np.zeros((height, width, 3), dtype=np.uint8)
+    for i in range(frames):
+        frame[:, :, 0] = i % 256
+        frame[:, ::16, 1] = 255
+        writer.write(frame)
+    writer.release()
+
+def allocating(stream, color, scale):
+    """
+    The pipeline before pooling, new arrays for the frame, the conversion and the resize.
+    """
+    ret, frame = stream.read()
+    if not ret:
+        return False
+    frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB if (color == 0) else cv2.COLOR_BGR2GRAY)
+    if scale[0] > 0 and scale[1] > 0:
+        frame = cv2.resize(frame, scale)
+    return True
+
+class Pooled():
+    def __init__(self):
+        self.converter = vp.FrameConverter()
+        self.pool = list()
+        self.next = 0
+
+    def __call__(self, stream, color, scale):
+        ret, frame = self.converter.read(stream)
+        if not ret:
+            return False
+        shape = vp.outputShape(frame, color, scale)
+        if (not self.pool) or (self.pool[0].shape != shape):
+            self.pool = [np.empty(shape, dtype=np.uint8) for _ in range(POOL_SIZE)]
+        dst = self.pool[self.next]
+        self.next = (self.next + 1) % POOL_SIZE
+        self.converter.convert(frame, color, scale, dst)
+        return True
+
+def benchmark(path, pipeline, color, scale, warmup):
+    stream = cv2.VideoCapture(path)
+    for _ in range(warmup): # Buffers are allocated for the first frames only.
+        pipeline(stream, color, scale)
+
+    collections = [0]
+    callback = lambda phase, info: collections.__setitem__(0, collections[0] + (phase == "start"))
+    gc.collect()
+    gc.callbacks.append(callback)
+    tracemalloc.start()
+
+    frames, allocated = 0, 0
+    start = time.perf_counter()
+    while True:
+        tracemalloc.reset_peak()
+        before = tracemalloc.get_traced_memory()[0]
+        if not pipeline(stream, color, scale):
+            break
+        allocated += tracemalloc.get_traced_memory()[1] - before
+        frames += 1
+    elapsed = time.perf_counter() - start
+
+    tracemalloc.stop()
+    gc.callbacks.remove(callback)
+    stream.release()
+    return frames, (elapsed / frames) * 1000, allocated / frames / 1024, collections[0]
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare the allocating and the pooled camera frame pipeline.")
+    parser.add_argument("--source", help="Clip to decode, a MJPG clip is generated if not given.")
+    parser.add_argument("--frames", type=int, default=300, help="Frames in the generated clip.")
+    parser.add_argument("--width", type=int, default=1920)
+    parser.add_argument("--height", type=int, default=1080)
+    parser.add_argument("--scale", default="1280x720", help="Output resolution, 0x0 keeps the source resolution.")
+    parser.add_argument("--color", type=int, default=0, help="0 RGB, 1 grayscale.")
+    parser.add_argument("--warmup", type=int, default=POOL_SIZE + 1, help="Frames decoded before measuring.")
+    args = parser.parse_args()
+
+    scale = tuple(int(v) for v in args.scale.lower().split("x"))
+    path = args.source
+    if path is None:
+        path = os.path.join(tempfile.mkdtemp(), "frame_pipeline.avi")
+        createClip(path, args.frames, args.width, args.height)
+
+    print("{:<11} {:>7} {:>10} {:>16} {:>7}".format("pipeline", "frames", "ms/frame", "KiB alloc/frame", "gc runs"))
+    for name, pipeline in (("allocating", allocating), ("pooled", Pooled())):
+        print("{:<11} {:>7} {:>10.2f} {:>16.1f} {:>7}".format(name, *benchmark(path, pipeline, args.color, scale, args.warmup)))
@@ -0,0 +1,36 @@
+"""
+Telemetry wire format benchmark, json vs binary.
+
+Compares bytes on the wire and decode time per packet, using the same random data as the dummy rover server.
+Run from the src folder: python benchmarks/telemetry_format.py
+"""
+
+import os
+import sys
+import time
+import argparse
+
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "package"))
+
+from communications import packet
+from communications.rover_server import generate_random_data
+
+def benchmark(fmt, samples):
+    packets = [packet.encode(generate_random_data(), fmt) for _ in range(samples)]
+    size = sum(len(p) for p in packets) / samples
+
+    start = time.perf_counter()
+    for p in packets:
+        packet.decode(p)
+    elapsed = time.perf_counter() - start
+    return size, (elapsed / samples) * 1000000
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare the json and binary telemetry formats.")
+    parser.add_argument("--samples", type=int, default=100000, help="Packets to decode per format.")
+    args = parser.parse_args()
+
+    print("{:<8} {:>12} {:>16}".format("format", "bytes/packet", "decode us/packet"))
+    for fmt in packet.PACKET_FORMATS:
+        size, decodeTime = benchmark(fmt, args.samples)
+        print("{:<8} {:>12.1f} {:>16.2f}".format(fmt, size, decodeTime))
@@ -0,0 +1,95 @@
+"""
+Glass-to-glass latency of a camera stream: a window flashes black/white on screen, the camera is pointed at it
+and the time from drawing a flash to showing a camera frame which saw it is measured.
+Both ends include a screen refresh, so what is measured is what the operator experiences.
+"""
+
+import time
+import numpy as np
+
+from PyQt5.QtCore import Qt, QTimer
+from PyQt5.QtWidgets import QWidget
+from PyQt5.QtGui import QImage, QPainter, QColor
+
+LATENCY_FLASH_INTERVAL = 1000 # msec between flashes, must be longer than the latency measured.
+LATENCY_SAMPLES = 8 # Flashes measured per run.
+LATENCY_TIMEOUT = 20.0 # Sec. until the run is given up.
+LATENCY_MIN_CONTRAST = 24 # Brightness difference (0 - 255) between a black and a white flash as seen by the camera.
+LATENCY_PROBE_SIZE = 16 # Frames are scaled down to this before measuring the brightness.
+
+def brightness(pixmap):
+    """
+    Mean brightness (0 - 255) of a frame.
+    """
+    image = pixmap.scaled(LATENCY_PROBE_SIZE, LATENCY_PROBE_SIZE).toImage().convertToFormat(QImage.Format_Grayscale8)
+    data = np.frombuffer(image.constBits().asstring(image.bytesPerLine() * image.height()), dtype=np.uint8)
+    return float(data.reshape(image.height(), image.bytesPerLine())[:, :image.width()].mean())
+
+class LatencyProbe(QWidget):
+    """
+    The flash window, frames shown by the camera window are passed to frame(). Calls done(text) when finished.
+    """
+    def __init__(self, id, done):
+        super().__init__(None, Qt.Window | Qt.WindowStaysOnTopHint)
+        self.setWindowTitle("{} - point the camera here".format(id))
+        self.resize(400, 400)
+        self.done = done
+        self.white = False
+        self.flashTime = None # When the current flash was drawn, None once a frame saw it.
+        self.drawn = True
+        self.low, self.high = None, None # Darkest + brightest frame seen.
+        self.samples = list()
+        self.start = time.perf_counter()
+
+        self.timer = QTimer(self)
+        self.timer.timeout.connect(self.flash)
+        self.timer.start(LATENCY_FLASH_INTERVAL)
+
+    def flash(self):
+        if (time.perf_counter() - self.start) > LATENCY_TIMEOUT:
+            self.finish()
+            return
+
+        self.white = not self.white
+        self.drawn = False
+        self.update()
+
+    def paintEvent(self, event):
+        painter = QPainter(self)
+        painter.fillRect(self.rect(), QColor(Qt.white if self.white else Qt.black))
+        painter.end()
+        if not self.drawn:
+            self.drawn = True
+            self.flashTime = time.perf_counter()
+
+    def frame(self, pixmap):
+        now = time.perf_counter()
+        value = brightness(pixmap)
+        self.low = value if (self.low is None) else min(self.low, value)
+        self.high = value if (self.high is None) else max(self.high, value)
+        if (self.flashTime is None) or ((self.high - self.low) < LATENCY_MIN_CONTRAST):
+            return
+
+        middle = (self.low + self.high) / 2
+        if (value > middle) == self.white:
+            self.samples.append(now - self.flashTime)
+            self.flashTime = None
+            if len(self.samples) >= LATENCY_SAMPLES:
+                self.finish()
+
+    def finish(self):
+        self.close()
+
+    def closeEvent(self, event):
+        """
+        Reports whatever was measured, also when the window is closed early.
+        """
+        self.timer.stop()
+        if self.done:
+            done, self.done = self.done, None
+            if self.samples:
+                samples = sorted(self.samples)
+                done("Glass-to-glass {:.0f} ms ({:.0f} - {:.0f})".format(samples[len(samples) // 2] * 1000, samples[0] * 1000, samples[-1] * 1000))
+            else:
+                done("Glass-to-glass: no flash seen")
+        super().closeEvent(event)
@@ -7,18 +7,23 @@ from configparser import ConfigParser
 from utils import warning
 from settings import settings as cfg
 from camera import video_threading as cam_thread_mngr
+from camera import video_recording
+from camera import video_process
 from ast import literal_eval as make_tuple
 
 VIDEO_CONFIG = None
 VIDEO_LIST = dict() # Map video stream name to video settings for that stream + active window, etc.
 VIDEO_MULTI_THREAD = False # Should all streams be rendered on one thread or on their own unique threads?
+VIDEO_MULTI_PROCESS = False # Should every stream be decoded in its own process?
 
-def createVideoDict(src, color=0, scalingWide=0, scalingTall=0, xpos=0, ypos=0, width=0, height=0):
+def createVideoDict(src, color=0, scalingWide=0, scalingTall=0, xpos=0, ypos=0, width=0, height=0, lowLatency=False, replay=False):
     return {
         "source": src,
         "color": color,
         "scaling": (scalingWide, scalingTall),
         "bounds": (xpos, ypos, width, height),
+        "lowLatency": lowLatency, # Minimal capture buffering, stale frames are discarded.
+        "replay": replay, # Keep an instant replay, hidden streams are then decoded too.
         "window": None,
     }
 
@@ -78,7 +83,7 @@ def load():
     """
     Load video streams available.
     """
-    global VIDEO_CONFIG, VIDEO_LIST, VIDEO_MULTI_THREAD
+    global VIDEO_CONFIG, VIDEO_LIST, VIDEO_MULTI_THREAD, VIDEO_MULTI_PROCESS
     VIDEO_CONFIG = ConfigParser()
     try:
         if not os.path.exists("videos.ini"):
@@ -93,10 +98,16 @@ def load():
 
             res = getResolution(v.get("scaling", "(0,0)"))
             bounds = getBounds(v.get("bounds", "(0,0,0,0)"))
-            VIDEO_LIST[k] = createVideoDict(v.get("source", ""), int(v.get("color", "0")), res[0], res[1], bounds[0], bounds[1], bounds[2], bounds[3])
+            VIDEO_LIST[k] = createVideoDict(v.get("source", ""), int(v.get("color", "0")), res[0], res[1], bounds[0], bounds[1], bounds[2], bounds[3], (v.get("lowLatency", "False") == "True"), (v.get("replay", "False") == "True"))
 
         VIDEO_MULTI_THREAD = (cfg.SETTINGS.get("main", "multithread") == "True")
-        cam_thread_mngr.initialize(VIDEO_MULTI_THREAD)     
+        VIDEO_MULTI_PROCESS = (cfg.SETTINGS.get("main", "multiprocess", fallback="False") == "True")
+        video_recording.RECORDING_SEGMENT_DURATION = float(cfg.SETTINGS.get("main", "recordingSegmentDuration", fallback=video_recording.RECORDING_SEGMENT_DURATION))
+        video_recording.RECORDING_SEGMENT_SIZE = float(cfg.SETTINGS.get("main", "recordingSegmentSize", fallback=video_recording.RECORDING_SEGMENT_SIZE))
+        video_recording.REPLAY_SECONDS = float(cfg.SETTINGS.get("main", "replaySeconds", fallback=video_recording.REPLAY_SECONDS))
+        video_recording.REPLAY_MEMORY = float(cfg.SETTINGS.get("main", "replayMemory", fallback=video_recording.REPLAY_MEMORY))
+        video_recording.REPLAY_QUALITY = int(cfg.SETTINGS.get("main", "replayQuality", fallback=video_recording.REPLAY_QUALITY))
+        cam_thread_mngr.initialize(VIDEO_MULTI_THREAD, VIDEO_MULTI_PROCESS)     
     except:
         warning.showWarning("Fatal Error", "Unable to read/create videos.ini", None)
 
@@ -112,6 +123,8 @@ def update(id, obj):
     VIDEO_CONFIG[id]["color"] = str(obj["color"])
     VIDEO_CONFIG[id]["scaling"] = str(obj["scaling"])
     VIDEO_CONFIG[id]["bounds"] = str(obj["bounds"])
+    VIDEO_CONFIG[id]["lowLatency"] = str(obj["lowLatency"])
+    VIDEO_CONFIG[id]["replay"] = str(obj["replay"])
     return True
 
 def save():
@@ -141,5 +154,9 @@ def shutdown():
         v["window"] = None
 
     VIDEO_LIST.clear()
+
+    # Finish the recordings before the encoder threads + decoder processes are killed on exit.
+    video_recording.closeAll()
+    video_process.joinDecoders()
     cam_thread_mngr.THREADING_SYNC = None
     save()    
@@ -0,0 +1,354 @@
+"""
+Decoding of video streams in separate processes,
+frames are handed to the GUI process through shared memory ring buffers.
+Must not import anything Qt related, it is imported by every decoder process.
+"""
+
+import os
+import time
+import threading
+import multiprocessing
+from multiprocessing import shared_memory
+
+import cv2
+import numpy as np
+
+from camera import video_recording as vr
+
+RING_SLOTS = 3 # Frames per ring, the decoder can run 1 frame ahead of a slow reader before it overwrites the frame being read.
+RING_HEADER = 128 # Bytes reserved in front of the frames.
+RING_SEQ, RING_SLOT_COUNT, RING_HEIGHT, RING_WIDTH, RING_CHANNELS, RING_CAPTURED, RING_SKIPPED, RING_RECORDING, RING_RECORD_WRITTEN, RING_RECORD_DROPPED, RING_RECORD_BACKLOG, RING_REPLAY_MSEC, RING_REPLAY_BYTES, RING_DISCARDED = range(14) # int64 header fields.
+RING_FIELDS = 14
+RING_DECODE_OFFSET = 120 # float64 decode time (sec.) in the header.
+DECODER_SUSPEND_TIME = 1.0 # How long to wait for commands while there is nothing to decode.
+DECODER_DECODE_GAIN = (1 / 16) # Smoothing of the decode time estimate.
+DECODER_CONTEXT = multiprocessing.get_context("spawn") # Never fork the GUI process, Qt + threads do not survive it.
+LATENCY_CAPTURE_OPTIONS = "fflags;nobuffer|flags;low_delay" # FFmpeg options of low latency streams, no input buffering.
+LATENCY_FRESH_RATIO = 0.5 # A grab returning within this part of the frame interval got a frame which was already buffered (stale).
+LATENCY_MAX_DISCARD = 30 # Stale frames discarded per read at most, so a source which never blocks still shows frames.
+LATENCY_OPEN_LOCK = threading.Lock() # The FFmpeg options are passed through the environment, every open holds it.
+LATENCY_BASE_OPTIONS = os.environ.get("OPENCV_FFMPEG_CAPTURE_OPTIONS") # Options set by the user, used for normal streams.
+
+def openCapture(source, lowLatency=False):
+    """
+    Open a stream, low latency streams are opened without input buffering + a capture buffer of 1 frame.
+    Returns (stream, success).
+    """
+    stream = cv2.VideoCapture()
+    options = LATENCY_CAPTURE_OPTIONS if lowLatency else LATENCY_BASE_OPTIONS
+    with LATENCY_OPEN_LOCK:
+        if options is None:
+            os.environ.pop("OPENCV_FFMPEG_CAPTURE_OPTIONS", None)
+        else:
+            os.environ["OPENCV_FFMPEG_CAPTURE_OPTIONS"] = options
+        ret = stream.open(source)
+
+    if lowLatency:
+        stream.set(cv2.CAP_PROP_BUFFERSIZE, 1) # Not supported by every backend, the reads below discard stale frames anyway.
+    return (stream, ret)
+
+def isLive(stream):
+    """
+    Files report a frame count, live streams do not. Files are never drained, every frame of a file is current.
+    """
+    return stream.get(cv2.CAP_PROP_FRAME_COUNT) <= 0
+
+def frameInterval(stream):
+    fps = stream.get(cv2.CAP_PROP_FPS)
+    return 1 / (fps if (0 < fps <= vr.RECORDING_FPS_MAX) else vr.RECORDING_FPS_DEFAULT)
+
+def outputShape(frame, color, scale):
+    """
+    Shape of a frame after scaling + colour conversion.
+    """
+    height, width = (scale[1], scale[0]) if (scale[0] > 0 and scale[1] > 0) else frame.shape[:2]
+    return (height, width, 3) if (color == 0) else (height, width)
+
+class FrameConverter():
+    """
+    Reads, scales + colour converts frames through buffers which are reused for every frame,
+    they are only reallocated when the source resolution or the scaling changes.
+    """
+    def __init__(self):
+        self.image = None # Decode buffer, VideoCapture.read fills it in place.
+        self.scaled = None # Scaled BGR frame.
+
+    def read(self, stream):
+        ret, frame = stream.read(self.image)
+        if ret:
+            self.image = frame
+        return ret, frame
+
+    def readLatest(self, stream, interval):
+        """
+        Grab until a grab has to wait for the source, that frame is the newest one, only it is decoded.
+        Returns (success, frame, stale frames discarded).
+        """
+        discarded = -1
+        while True:
+            start = time.perf_counter()
+            if not stream.grab():
+                return (False, None, max(discarded, 0))
+            discarded += 1
+            if ((time.perf_counter() - start) >= (interval * LATENCY_FRESH_RATIO)) or (discarded >= LATENCY_MAX_DISCARD):
+                break
+
+        ret, frame = stream.retrieve(self.image)
+        if ret:
+            self.image = frame
+        return (ret, frame, discarded)
+
+    def convert(self, frame, color, scale, dst):
+        """
+        Scale + convert into dst, which must have the output shape.
+        """
+        if scale[0] > 0 and scale[1] > 0:
+            shape = (scale[1], scale[0]) + frame.shape[2:]
+            if (self.scaled is None) or (self.scaled.shape != shape):
+                self.scaled = np.empty(shape, dtype=np.uint8)
+            frame = cv2.resize(frame, (scale[0], scale[1]), dst=self.scaled)
+        return cv2.cvtColor(frame, cv2.COLOR_BGR2RGB if (color == 0) else cv2.COLOR_BGR2GRAY, dst=dst)
+
+class FrameRing():
+    """
+    Fixed size frames in shared memory, written by one decoder process and read by the GUI process without copying.
+    The header holds the number of frames written so far, the latest frame is in slot (seq - 1) % slots.
+    """
+    def __init__(self, name=None, shape=None, slots=RING_SLOTS):
+        if name is None:
+            size = RING_HEADER + slots * int(np.prod(shape))
+            self.shm = shared_memory.SharedMemory(create=True, size=size)
+        else:
+            self.shm = shared_memory.SharedMemory(name=name)
+
+        self.header = np.ndarray((RING_FIELDS,), dtype=np.int64, buffer=self.shm.buf)
+        self.decodeTime = np.ndarray((1,), dtype=np.float64, buffer=self.shm.buf, offset=RING_DECODE_OFFSET)
+        if name is None:
+            self.header[:] = 0
+            self.header[RING_SLOT_COUNT:RING_CHANNELS + 1] = (slots, shape[0], shape[1], (shape[2] if len(shape) > 2 else 1))
+            self.decodeTime[0] = 0.0
+        else:
+            channels = int(self.header[RING_CHANNELS])
+            shape = (int(self.header[RING_HEIGHT]), int(self.header[RING_WIDTH])) + ((channels,) if channels > 1 else ())
+            slots = int(self.header[RING_SLOT_COUNT])
+
+        self.name = self.shm.name
+        self.shape = tuple(shape)
+        self.slots = slots
+        self.frames = np.ndarray((slots,) + self.shape, dtype=np.uint8, buffer=self.shm.buf, offset=RING_HEADER)
+
+    def close(self, unlink=False):
+        """
+        Release the mapping, the creator (or the last user) unlinks it.
+        """
+        self.header = self.decodeTime = self.frames = None # Views must be gone before the buffer can be closed.
+        try:
+            self.shm.close()
+            if unlink:
+                self.shm.unlink()
+        except (FileNotFoundError, BufferError):
+            pass
+
+class StreamDecoder():
+    """
+    Runs inside the decoder process, reads + converts frames straight into the ring of the stream.
+    Commands from the GUI process arrive over a pipe: ("config", params), ("refresh", params), ("record", bool), ("visible", bool),
+    ("replayFrame", sec. back), ("replaySave",) or ("stop",).
+    """
+    def __init__(self, id, params, conn, frameReady, segment, replay):
+        self.id = id
+        self.segment = segment # Recording segment limits.
+        self.replaySettings = replay
+        self.replay = None # Instant replay, only while enabled for the camera.
+        self.source, self.color, self.scaling, self.lowLatency, self.replayEnabled = params
+        self.conn = conn
+        self.frameReady = frameReady
+        self.stream = None
+        self.live = False
+        self.interval = 0.0 # Frame interval (sec.) of the source.
+        self.ring = None
+        self.converter = FrameConverter()
+        self.rate = vr.FrameRateMeter() # Measured source frame rate, used for recordings.
+        self.recorder = None
+        self.rec = False
+        self.visible = True
+        self.updateReplay()
+        self.finished = False
+        self.running = True
+        self.captured = 0
+        self.skipped = 0 # Frames only grabbed, recorded or kept for the instant replay, never converted.
+        self.discarded = 0 # Stale frames dropped by low latency reads.
+
+    def openStream(self):
+        try:
+            self.finished = False
+            self.rate.reset()
+            self.stream, ret = openCapture(self.source, self.lowLatency)
+            self.live = isLive(self.stream)
+            self.interval = frameInterval(self.stream)
+            return ret
+        except Exception as e:
+            print(e)
+            return False
+
+    def closeStream(self):
+        if self.stream:
+            self.stream.release()
+        if self.recorder:
+            self.recorder.close()
+        self.stream = None
+        self.recorder = None
+
+    def handle(self, command):
+        if command[0] == "stop":
+            self.running = False
+        elif command[0] == "record":
+            self.rec = command[1]
+        elif command[0] == "visible":
+            self.visible = command[1]
+        elif command[0] == "replayFrame":
+            self.conn.send(("replayFrame", self.replay.frameAt(command[1]) if self.replay else None))
+        elif command[0] == "replaySave":
+            if self.replay:
+                self.replay.save()
+        elif command[0] in ("config", "refresh"):
+            self.source, self.color, self.scaling, self.lowLatency, self.replayEnabled = command[1]
+            self.updateReplay()
+            if command[0] == "refresh":
+                self.closeStream()
+                self.finished = False
+
+    def finish(self):
+        self.finished = True
+        self.closeStream()
+        self.conn.send(("finished",))
+
+    def recording(self, frame):
+        """
+        Record video, if so desired. Cleanup when done!!!
+        """
+        if self.rec:
+            if self.recorder is None:
+                self.recorder = vr.RecordingWriter(self.id, vr.recordingFps(self.rate, self.stream), self.segment)
+            self.recorder.put(frame)
+        elif self.recorder: # Recording is off but we were recording, release!
+            self.recorder.close()
+            self.recorder = None
+
+        if self.ring:
+            stats = self.recorder.getStatistics() if self.recorder else None
+            self.ring.header[RING_RECORDING] = (stats is not None)
+            if stats:
+                self.ring.header[RING_RECORD_WRITTEN:RING_RECORD_BACKLOG + 1] = (stats["written"], stats["dropped"], stats["backlog"])
+
+    def updateReplay(self):
+        enabled = self.replayEnabled and (self.replaySettings[0] > 0)
+        if enabled and (self.replay is None):
+            self.replay = vr.InstantReplay(self.id, *self.replaySettings)
+        elif (not enabled) and self.replay:
+            self.replay.close()
+            self.replay = None
+            if self.ring:
+                self.ring.header[RING_REPLAY_MSEC:RING_REPLAY_BYTES + 1] = 0
+
+    def replayFrame(self, frame):
+        self.replay.put(frame, time.time())
+        if self.ring:
+            stats = self.replay.getStatistics()
+            self.ring.header[RING_REPLAY_MSEC:RING_REPLAY_BYTES + 1] = (int(stats["seconds"] * 1000), stats["bytes"])
+
+    def write(self, frame, start):
+        """
+        Scale + convert the frame directly into the next ring slot, a new ring is created whenever the frame shape changes.
+        """
+        shape = outputShape(frame, self.color, self.scaling)
+        if (self.ring is None) or (self.ring.shape != shape):
+            old = self.ring
+            self.ring = FrameRing(shape=shape)
+            self.conn.send(("ring", self.ring.name))
+            if old:
+                old.close(unlink=True)
+
+        seq = int(self.ring.header[RING_SEQ])
+        slot = self.ring.frames[seq % self.ring.slots]
+        self.converter.convert(frame, self.color, self.scaling, slot)
+
+        self.captured += 1
+        self.ring.decodeTime[0] += ((time.perf_counter() - start) - self.ring.decodeTime[0]) * DECODER_DECODE_GAIN
+        self.ring.header[RING_CAPTURED] = self.captured
+        self.ring.header[RING_SEQ] = seq + 1 # Publish last, the slot is complete.
+        self.frameReady.set()
+
+    def skip(self):
+        self.skipped += 1
+        if self.ring:
+            self.ring.header[RING_SKIPPED] = self.skipped
+
+    def run(self):
+        while self.running:
+            idle = self.finished or (len(self.source) <= 0)
+            if self.conn.poll(DECODER_SUSPEND_TIME if idle else 0):
+                self.handle(self.conn.recv())
+                continue
+            if idle:
+                continue
+
+            # Try to open the stream, if it fails, close and try again 'later'.
+            if (self.stream is None) and not self.openStream():
+                self.closeStream()
+                time.sleep(DECODER_SUSPEND_TIME)
+                continue
+
+            try:
+                start = time.perf_counter()
+                if not (self.visible or self.rec or self.replay):
+                    # Hidden, not recording + no instant replay, only advance the stream position so it is current once shown again.
+                    ret, frame = self.stream.grab(), None
+                elif self.lowLatency and self.live:
+                    ret, frame, discarded = self.converter.readLatest(self.stream, self.interval)
+                    self.discarded += discarded
+                    if self.ring:
+                        self.ring.header[RING_DISCARDED] = self.discarded
+                else:
+                    ret, frame = self.converter.read(self.stream)
+
+                if not ret:
+                    self.finish()
+                    continue
+                self.rate.tick(time.time())
+                if frame is not None:
+                    self.recording(frame)
+                    if self.replay:
+                        self.replayFrame(frame)
+                if self.visible:
+                    self.write(frame, start)
+                else:
+                    self.skip() # Recording or instant replay only, no need to convert.
+            except Exception as e:
+                print(e)
+
+        self.closeStream()
+        if self.replay:
+            self.replay.close()
+        vr.closeAll() # Replays still being saved, the process must not exit before they are written.
+        if self.ring:
+            self.ring.close(unlink=True)
+
+def joinDecoders(timeout=vr.RECORDING_CLOSE_TIMEOUT):
+    """
+    Wait for the decoder processes which were told to stop, so they can finish their recordings.
+    They are daemons, anything still running when the GUI process exits is terminated.
+    """
+    deadline = time.time() + timeout
+    for p in multiprocessing.active_children():
+        if p.name.startswith("Decode "):
+            p.join(max(deadline - time.time(), 0))
+
+def decodeProcess(id, params, conn, frameReady, segment, replay):
+    """
+    Decoder process entry point.
+    """
+    try:
+        StreamDecoder(id, params, conn, frameReady, segment, replay).run()
+    except (EOFError, BrokenPipeError, KeyboardInterrupt): # GUI process is gone.
+        pass
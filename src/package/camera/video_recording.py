@@ -0,0 +1,398 @@
+"""
+Recording of video streams, frames are encoded on a dedicated thread behind a bounded queue,
+so encoding never stalls the capture or the live view.
+Recordings are split into segments by duration or size, with a csv index next to them (one row per segment)
+so a tool can find the segment + frame for a timestamp without decoding from the start.
+Every stream also keeps the last few sec. as JPEG frames in memory (instant replay), to scrub back or save after the fact.
+Must not import anything Qt related, it is also used by the decoder processes.
+"""
+
+import os
+import csv
+import time
+import queue
+import bisect
+import datetime
+import threading
+from collections import deque
+
+import cv2
+import numpy as np
+
+RECORDING_QUEUE_SIZE = 30 # Frames waiting to be encoded, further frames are dropped. Buffers are only allocated when needed.
+RECORDING_FPS_DEFAULT = 30 # Used when the frame rate is unknown.
+RECORDING_FPS_MAX = 240 # Anything above is treated as unknown.
+RECORDING_FPS_GAIN = (1 / 16) # Smoothing of the frame interval estimate.
+RECORDING_SEGMENT_DURATION = 300 # Sec. per segment, 0 for no limit. Set from the settings by the video manager.
+RECORDING_SEGMENT_SIZE = 1024 # MB per segment, 0 for no limit. Set from the settings by the video manager.
+RECORDING_SIZE_CHECK = 30 # Frames between segment size checks.
+RECORDING_CLOSE_TIMEOUT = 10.0 # Sec. to wait for queued frames to be written when a recording is closed.
+RECORDING_WRITERS = set() # Open recordings, closed on shutdown.
+RECORDING_SAVES = set() # Instant replay saves in progress, waited for on shutdown.
+RECORDING_WRITERS_LOCK = threading.Lock()
+RECORDING_INDEX_FIELDS = ("segment", "start", "end", "first_frame", "frames", "fps", "offset", "bytes")
+REPLAY_SECONDS = 30 # Sec. kept for instant replay, for cameras it is enabled for, 0 disables it. Set from the settings by the video manager.
+REPLAY_MEMORY = 256 # MB per stream, the oldest frames are dropped first.
+REPLAY_QUALITY = 80 # JPEG quality.
+
+def recordingPath(id):
+    """
+    Path of a new recording without extension, creates the folder.
+    """
+    now = datetime.datetime.now()
+    vid = "videos/{}-{}-{}/{}_{}-{}-{}".format(
+        str(now.day),
+        str(now.month),
+        str(now.year),
+        id.replace(" ", "-").lower(),
+        str(now.hour),
+        str(now.minute),
+        str(now.second)
+        )
+    directory = os.path.dirname(vid)
+
+    if not os.path.exists(directory):
+        os.makedirs(directory)
+
+    return vid
+
+def getSegmentLimits():
+    """
+    (duration in sec., size in MB) of a segment, passed on to the decoder processes which do not load the settings.
+    """
+    return (RECORDING_SEGMENT_DURATION, RECORDING_SEGMENT_SIZE)
+
+def getReplaySettings():
+    """
+    (sec., memory in MB, JPEG quality) of the instant replay, passed on to the decoder processes which do not load the settings.
+    """
+    return (REPLAY_SECONDS, REPLAY_MEMORY, REPLAY_QUALITY)
+
+def createVideoWriter(path, width, height, fps):
+    return cv2.VideoWriter(path, cv2.VideoWriter_fourcc('M','J','P','G'), fps, (width, height))
+
+class RecordingSegment():
+    """
+    One file of a recording.
+    """
+    def __init__(self, path, shape, fps, start, firstFrame, offset):
+        self.path = path
+        self.shape = shape
+        self.start = start
+        self.end = start
+        self.firstFrame = firstFrame
+        self.offset = offset # Bytes of all previous segments.
+        self.frames = 0
+        self.writer = createVideoWriter(path, shape[1], shape[0], fps)
+
+    def write(self, frame, t):
+        self.writer.write(frame)
+        self.frames += 1
+        self.end = t
+
+    def size(self):
+        return os.path.getsize(self.path) if os.path.exists(self.path) else 0
+
+    def full(self, t, duration, size):
+        if (duration > 0) and ((t - self.start) >= duration):
+            return True
+        return (size > 0) and (self.frames % RECORDING_SIZE_CHECK == 0) and (self.size() >= size * 1024 * 1024)
+
+    def close(self):
+        self.writer.release()
+        return self.size()
+
+def appendIndex(path, segment, fps, size):
+    """
+    Append the row of a closed segment to the index of a recording.
+    """
+    new = not os.path.exists(path + ".csv")
+    with open(path + ".csv", "a", newline="") as f:
+        w = csv.writer(f)
+        if new:
+            w.writerow(RECORDING_INDEX_FIELDS)
+        w.writerow((os.path.basename(segment.path), segment.start, segment.end, segment.firstFrame, segment.frames, fps, segment.offset, size))
+
+class FrameRateMeter():
+    """
+    Smoothed frame rate of a stream, from the time between frames.
+    """
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.last = None
+        self.interval = None
+
+    def tick(self, now):
+        if self.last is not None:
+            interval = (now - self.last)
+            self.interval = interval if (self.interval is None) else (self.interval + (interval - self.interval) * RECORDING_FPS_GAIN)
+        self.last = now
+
+    def get(self):
+        return (1 / self.interval) if self.interval else None
+
+def recordingFps(meter, stream):
+    """
+    Frame rate to record with. Files are read faster than real time, so their own frame rate is used,
+    live streams use the measured rate.
+    """
+    fps = stream.get(cv2.CAP_PROP_FPS)
+    if (stream.get(cv2.CAP_PROP_FRAME_COUNT) <= 0) or not (0 < fps <= RECORDING_FPS_MAX):
+        fps = meter.get() or 0
+    return fps if (0 < fps <= RECORDING_FPS_MAX) else RECORDING_FPS_DEFAULT
+
+class RecordingWriter():
+    """
+    Copies frames into a bounded pool of buffers and encodes them on its own thread,
+    put() never waits, a frame is dropped when every buffer is still waiting to be encoded.
+    """
+    def __init__(self, id, fps, segment=None, size=RECORDING_QUEUE_SIZE):
+        self.id = id
+        self.fps = fps
+        self.segmentDuration, self.segmentSize = segment if segment else getSegmentLimits()
+        self.size = size
+        self.lock = threading.Lock()
+        self.queue = queue.Queue()
+        self.free = list()
+        self.allocated = 0
+        self.shape = None
+        self.written = 0
+        self.dropped = 0
+        self.maxBacklog = 0
+        self.segments = 0
+        self.closed = False
+        self.thread = threading.Thread(target=self.run, name="Recording {}".format(id), daemon=True)
+        self.thread.start()
+        with RECORDING_WRITERS_LOCK:
+            RECORDING_WRITERS.add(self)
+
+    def put(self, frame, t=None):
+        """
+        Queue a frame, t is the capture time (unix time), now if not given.
+        """
+        with self.lock:
+            if self.closed:
+                return False
+            if frame.shape != self.shape: # Resolution changed, buffers of the old shape are not returned to the pool.
+                self.shape = frame.shape
+                self.free = list()
+                self.allocated = 0
+
+            if self.free:
+                buffer = self.free.pop()
+            elif self.allocated < self.size:
+                buffer = np.empty(frame.shape, dtype=frame.dtype)
+                self.allocated += 1
+            else:
+                self.dropped += 1
+                return False
+
+        np.copyto(buffer, frame)
+        self.queue.put((buffer, time.time() if t is None else t))
+        self.maxBacklog = max(self.maxBacklog, self.queue.qsize())
+        return True
+
+    def close(self, timeout=RECORDING_CLOSE_TIMEOUT):
+        """
+        Stop recording, waits up to timeout sec. for the queued frames to be written + the last segment to be closed.
+        """
+        with RECORDING_WRITERS_LOCK:
+            if self.closed:
+                return
+            self.closed = True
+            RECORDING_WRITERS.discard(self)
+
+        self.queue.put(None)
+        self.thread.join(timeout)
+        if self.thread.is_alive():
+            print("Recording {}: {} frames still queued after {} sec., the last segment may be incomplete.".format(self.id, self.queue.qsize(), timeout))
+        if self.dropped > 0:
+            print("Recording {}: {} frames dropped, {} written.".format(self.id, self.dropped, self.written))
+
+    def closeSegment(self, segment):
+        """
+        Close a segment and append its row to the index, returns the byte offset for the next one.
+        """
+        size = segment.close()
+        appendIndex(self.path, segment, self.fps, size)
+        return segment.offset + size
+
+    def run(self):
+        try:
+            self.path = recordingPath(self.id)
+        except Exception as e:
+            print(e)
+            return
+        segment, offset = None, 0
+        while True:
+            item = self.queue.get()
+            if item is None:
+                break
+
+            buffer, t = item
+            try:
+                # New segment when the current one is full or the resolution changed.
+                if (segment is None) or (buffer.shape != segment.shape) or segment.full(t, self.segmentDuration, self.segmentSize):
+                    if segment:
+                        offset = self.closeSegment(segment)
+                    segment = RecordingSegment("{}_{:03d}.avi".format(self.path, self.segments), buffer.shape, self.fps, t, self.written, offset)
+                    self.segments += 1
+                segment.write(buffer, t)
+                self.written += 1
+            except Exception as e:
+                print(e)
+
+            with self.lock:
+                if buffer.shape == self.shape:
+                    self.free.append(buffer)
+
+        if segment:
+            self.closeSegment(segment)
+
+    def getStatistics(self):
+        return {
+            "fps": self.fps,
+            "written": self.written,
+            "dropped": self.dropped,
+            "backlog": self.queue.qsize(),
+            "maxBacklog": self.maxBacklog,
+            "segments": self.segments
+        }
+
+def closeAll(timeout=RECORDING_CLOSE_TIMEOUT):
+    """
+    Close every open recording + wait for the instant replay saves,
+    the encoder threads are daemons and would be killed with frames still queued on exit.
+    """
+    deadline = time.time() + timeout
+    with RECORDING_WRITERS_LOCK:
+        writers = list(RECORDING_WRITERS)
+        saves = list(RECORDING_SAVES)
+    for w in writers:
+        w.close(max(deadline - time.time(), 0))
+    for t in saves:
+        t.join(max(deadline - time.time(), 0))
+        if t.is_alive():
+            print("{} still running after {} sec., the replay may be incomplete.".format(t.name, timeout))
+
+class InstantReplay():
+    """
+    The last sec. of a stream as JPEG frames in memory, capped by duration and size.
+    Frames are encoded on their own thread, put() never waits, frames arriving while the encoder is busy are skipped.
+    """
+    def __init__(self, id, seconds=REPLAY_SECONDS, memory=REPLAY_MEMORY, quality=REPLAY_QUALITY):
+        self.id = id
+        self.seconds = seconds
+        self.memory = memory * 1024 * 1024
+        self.quality = quality
+        self.lock = threading.Lock()
+        self.frames = deque() # (capture time, JPEG)
+        self.times = deque()
+        self.bytes = 0
+        self.pending = None # (buffer, t) waiting to be encoded.
+        self.spare = None # Buffer reused for the next copy.
+        self.skipped = 0
+        self.running = True
+        self.wakeup = threading.Event()
+        self.thread = threading.Thread(target=self.run, name="Replay {}".format(id), daemon=True)
+        self.thread.start()
+
+    def put(self, frame, t):
+        with self.lock:
+            if self.pending:
+                buffer = self.pending[0]
+                self.skipped += 1
+            else:
+                buffer = self.spare
+            self.pending = self.spare = None
+
+        if (buffer is None) or (buffer.shape != frame.shape):
+            buffer = np.empty(frame.shape, dtype=frame.dtype)
+        np.copyto(buffer, frame)
+        with self.lock:
+            self.pending = (buffer, t)
+        self.wakeup.set()
+
+    def close(self):
+        self.running = False
+        self.wakeup.set()
+
+    def run(self):
+        while self.running:
+            self.wakeup.wait()
+            self.wakeup.clear()
+            with self.lock:
+                item = self.pending
+                self.pending = None
+            if item is None:
+                continue
+
+            buffer, t = item
+            ok, jpeg = cv2.imencode(".jpg", buffer, (cv2.IMWRITE_JPEG_QUALITY, self.quality))
+            with self.lock:
+                self.spare = buffer
+                if ok:
+                    self.frames.append((t, jpeg))
+                    self.times.append(t)
+                    self.bytes += jpeg.nbytes
+                    while self.frames and (((t - self.times[0]) > self.seconds) or (self.bytes > self.memory)):
+                        self.bytes -= self.frames.popleft()[1].nbytes
+                        self.times.popleft()
+
+    def frameAt(self, secondsBack):
+        """
+        Returns (age in sec., JPEG) of the frame closest to secondsBack before the newest one, None if empty.
+        """
+        with self.lock:
+            if not self.frames:
+                return None
+            newest = self.times[-1]
+            idx = min(bisect.bisect_left(self.times, newest - secondsBack), len(self.frames) - 1)
+            t, jpeg = self.frames[idx]
+        return (newest - t, jpeg)
+
+    def getStatistics(self):
+        with self.lock:
+            return {
+                "frames": len(self.frames),
+                "seconds": (self.times[-1] - self.times[0]) if self.frames else 0.0,
+                "bytes": self.bytes,
+                "skipped": self.skipped
+            }
+
+    def save(self):
+        """
+        Write the current window to disk as a recording with its index, on a background thread.
+        """
+        with self.lock:
+            frames = list(self.frames)
+        if frames:
+            thread = threading.Thread(target=saveReplay, args=(self.id, frames), name="Save replay {}".format(self.id), daemon=True)
+            with RECORDING_WRITERS_LOCK:
+                RECORDING_SAVES.add(thread)
+            thread.start()
+
+def saveReplay(id, frames):
+    """
+    The frame rate comes from the capture times of the buffered frames, not from the source,
+    frames skipped while the encoder was busy are missing from the buffer.
+    """
+    try:
+        path = recordingPath("{} replay".format(id))
+        elapsed = frames[-1][0] - frames[0][0]
+        fps = ((len(frames) - 1) / elapsed) if elapsed > 0 else 0
+        fps = fps if (0 < fps <= RECORDING_FPS_MAX) else RECORDING_FPS_DEFAULT
+        segment = None
+        for t, jpeg in frames:
+            frame = cv2.imdecode(jpeg, cv2.IMREAD_COLOR)
+            if segment is None:
+                segment = RecordingSegment("{}_000.avi".format(path), frame.shape, fps, t, 0, 0)
+            segment.write(frame, t)
+        appendIndex(path, segment, fps, segment.close())
+    except Exception as e:
+        print(e)
+    finally:
+        with RECORDING_WRITERS_LOCK:
+            RECORDING_SAVES.discard(threading.current_thread())
@@ -6,18 +6,25 @@ uses openCV for rendering.
 import time
 import threading
 import cv2
-import datetime
-import os
+import numpy as np
 
 from PyQt5.QtCore import QThread, pyqtSignal, pyqtSlot, QObject, Qt
 from PyQt5.QtGui import QImage, QPixmap
 from camera import video_manager as vm
 from camera import video_window as vw
+from camera import video_process as vp
+from camera import video_recording as vr
 from widgets import logger as log
+from utils.math import maxVal
 
 class CameraEvents(QObject):
-    pixmap = pyqtSignal(dict) # Send a dict of pixmaps.
+    """
+    Per stream channel to the window showing it, so a window only receives its own frames.
+    """
+    pixmap = pyqtSignal(QPixmap) # Latest frame.
     finished = pyqtSignal(str) # Which video finished.
+    statistics = pyqtSignal(dict) # Capture statistics.
+    replay = pyqtSignal(QPixmap, float) # Instant replay frame + its age (sec.).
 
     def __init__(self):
         super().__init__()
@@ -28,24 +35,98 @@ class CameraEvents(QObject):
     def dispatchFinishedEvent(self, v):
         self.finished.emit(str(v))
 
-THREADING_EVENTS = CameraEvents()
+    def dispatchStatisticsEvent(self, v):
+        self.statistics.emit(v)
+
+    def dispatchReplayEvent(self, v, age):
+        self.replay.emit(v, age)
+
 THREADING_SUSPEND_TIME = 1.0 # How long to wait during inactivity? (prevent thread starvation)
 THREADING_SHUTDOWN = False
 THREADING_SYNC = None
+THREADING_STATISTICS_INTERVAL = 1.0 # Time between capture statistics updates.
+THREADING_DECODE_GAIN = (1 / 16) # Smoothing of the decode time estimate.
+THREADING_FRAME_POOL = 3 # Output buffers per stream: one being written, one waiting in the slot, one being shown.
+
+def wrapFrame(buffer):
+    """
+    QImage sharing the memory of a RGB or grayscale frame, no copy.
+    """
+    return QImage(buffer.data, buffer.shape[1], buffer.shape[0], buffer.strides[0], QImage.Format_RGB888 if (buffer.ndim > 2) else QImage.Format_Grayscale8)
+
+def createFrameBuffer(shape):
+    """
+    Output buffer + the QImage wrapping it, created once and reused for every frame.
+    """
+    buffer = np.empty(shape, dtype=np.uint8)
+    return (buffer, wrapFrame(buffer))
+
+def replayPixmap(jpeg, color):
+    """
+    Decode an instant replay frame, scrubbing only, not used for the live view.
+    """
+    frame = cv2.imdecode(jpeg, cv2.IMREAD_COLOR)
+    frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB if (color == 0) else cv2.COLOR_BGR2GRAY)
+    return QPixmap.fromImage(wrapFrame(frame))
 
 class CameraStreamObject(QObject):
     def __init__(self, id, obj):
         super().__init__()
         self.id = id
         self.obj = obj
+        self.events = CameraEvents()
+        self.visible = True # Frames of hidden/minimized windows are not delivered.
         self.stream = None
+        self.live = False
+        self.interval = 0.0 # Frame interval (sec.) of the source.
         self.finished = False
         self.rec = False
         self.recorder = None
         self.refresh = False
+        self.stopped = False
+
+        # Single slot, latest frame buffer, the capture worker overwrites whatever the compositor has not taken yet.
+        self.frameLock = threading.Lock()
+        self.frame = None # (buffer, image) from the pool.
+        self.reading = None # Pool entry the compositor is turning into a pixmap.
+        self.pool = list()
+        self.converter = vp.FrameConverter()
+        self.rate = vr.FrameRateMeter() # Measured source frame rate, used for recordings.
+        self.replay = None # Instant replay, only while enabled for the camera.
+        self.frameReady = None # Set by the worker whenever a new frame is available, shared by every stream of a sync object.
+
+        # Capture statistics, the counters are written by the worker only.
+        self.captured = 0
+        self.dropped = 0
+        self.skipped = 0 # Frames only grabbed, recorded or kept for the instant replay, never converted.
+        self.discarded = 0 # Stale frames dropped by low latency reads.
+        self.decodeTime = 0.0 # sec.
+        self.fps = 0.0
+        self.lastFpsTime = time.time()
+        self.lastFpsCount = 0
+
+        # Each stream is captured on its own worker, so a stalled source (e.g. RTSP) never holds up the other cameras.
+        # Daemon thread, since a blocking read can not be interrupted and must not keep the app alive.
+        self.worker = threading.Thread(target=self.capture, name="Capture {}".format(id), daemon=True)
 
     def __del__(self):
-        self.closeStream()
+        self.stop()
+
+    def start(self, frameReady):
+        self.frameReady = frameReady
+        self.worker.start()
+
+    def setVisible(self, visible):
+        self.visible = visible
+        if not visible:
+            with self.frameLock:
+                self.frame = None # Stale once shown again.
+
+    def stop(self):
+        """
+        Tell the worker to release the stream and exit, does not wait for a blocking read to return.
+        """
+        self.stopped = True
 
     def openStream(self):
         """
@@ -56,8 +137,11 @@ class CameraStreamObject(QObject):
                 self.stream.release()
 
             self.finished = False
-            self.stream = cv2.VideoCapture(None)
-            return self.stream.open(self.obj["source"])            
+            self.rate.reset()
+            self.stream, ret = vp.openCapture(self.obj["source"], self.obj["lowLatency"])
+            self.live = vp.isLive(self.stream)
+            self.interval = vp.frameInterval(self.stream)
+            return ret
         except Exception as e:
             log.LOGGER_EVENTS.dispatchLogEvent(e, log.LOGGER_PRIORITY_ERROR)
             print(e)
@@ -73,7 +157,7 @@ class CameraStreamObject(QObject):
                 self.stream.release()
 
             if self.recorder:
-                self.recorder.release()
+                self.recorder.close()
 
             res = True
         except Exception as e:
@@ -90,29 +174,14 @@ class CameraStreamObject(QObject):
         """
         self.finished = True
         self.closeStream()
-        THREADING_EVENTS.dispatchFinishedEvent(self.id)    
+        self.events.dispatchFinishedEvent(self.id)
 
     def createVideoForRecording(self):
         """
-        Create recorder object, folder path + file!
+        Create recorder object, encodes on its own thread with the measured frame rate.
         """
         try:
-            time = datetime.datetime.now()        
-            vid = "videos/{}-{}-{}/{}_{}-{}-{}.avi".format(
-                str(time.day), 
-                str(time.month), 
-                str(time.year),
-                self.id.replace(" ", "-").lower(),
-                str(time.hour),
-                str(time.minute),
-                str(time.second)
-                )
-            directory = os.path.dirname(vid)
-
-            if not os.path.exists(directory):
-                os.makedirs(directory)
-
-            return cv2.VideoWriter(vid, cv2.VideoWriter_fourcc('M','J','P','G'), 60, (int(self.stream.get(3)), int(self.stream.get(4))))
+            return vr.RecordingWriter(self.id, vr.recordingFps(self.rate, self.stream))
         except Exception as e:
             log.LOGGER_EVENTS.dispatchLogEvent(e, log.LOGGER_PRIORITY_ERROR)
             print(e)
@@ -126,14 +195,43 @@ class CameraStreamObject(QObject):
             if self.recorder is None:
                 self.recorder = self.createVideoForRecording()
             if self.recorder:
-                self.recorder.write(frame)
+                self.recorder.put(frame)
         elif self.recorder: # Recording is off but we were recording, release!
-            self.recorder.release()
+            self.recorder.close()
             self.recorder = None
 
-    def render(self):
+        if self.replay:
+            self.replay.put(frame, time.time())
+
+    def updateReplay(self):
+        """
+        Create or release the instant replay when it is switched on/off for the camera.
+        """
+        enabled = self.obj["replay"] and (vr.REPLAY_SECONDS > 0)
+        if enabled and (self.replay is None):
+            self.replay = vr.InstantReplay(self.id)
+        elif (not enabled) and self.replay:
+            self.replay.close()
+            self.replay = None
+
+    def requestReplayFrame(self, secondsBack):
+        """
+        Show the replay frame secondsBack before the newest one.
+        """
+        replay = self.replay
+        item = replay.frameAt(secondsBack) if replay else None
+        if item:
+            self.events.dispatchReplayEvent(replayPixmap(item[1], self.obj["color"]), item[0])
+
+    def saveReplay(self):
+        replay = self.replay
+        if replay:
+            replay.save()
+
+    def decode(self):
         """
-        Render one frame, return the result frame.
+        Read + convert one frame, returns the converted frame, None if there was nothing to read
+        and False if the frame was not converted since nobody is looking at it.
         """
         # If user wants to refresh, clear capture obj.
         if self.refresh:
@@ -143,6 +241,8 @@ class CameraStreamObject(QObject):
             self.refresh = False
             self.finished = False
             
+        self.updateReplay()
+
         # Finished or no source? Don't care.
         if self.finished or (len(self.obj["source"]) <= 0):
             return None
@@ -156,14 +256,29 @@ class CameraStreamObject(QObject):
         try:
             color = self.obj["color"]
             scale = self.obj["scaling"]   
-            ret, frame = self.stream.read()
+            if not (self.visible or self.rec or self.replay):
+                # Hidden, not recording + no instant replay, only advance the stream position so it is current once shown again.
+                if self.stream.grab():
+                    self.rate.tick(time.time())
+                    result = False
+                else:
+                    self.finish()
+                return result
+
+            if self.obj["lowLatency"] and self.live:
+                ret, frame, discarded = self.converter.readLatest(self.stream, self.interval)
+                self.discarded += discarded
+            else:
+                ret, frame = self.converter.read(self.stream)
             if ret:
+                self.rate.tick(time.time())
+            if ret and not self.visible: # Recording or instant replay only, no need to convert.
                 self.recording(frame)
-                finishedFrame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB if (color == 0) else cv2.COLOR_BGR2GRAY)
-                if scale[0] > 0 and scale[1] > 0: # Check if it will scale the image down or up and use InterArea Interpolation for downscale and InterLinear for upscale.
-                    finishedFrame = cv2.resize(finishedFrame, scale)   
-
-                result = QPixmap.fromImage(QImage(finishedFrame.data, finishedFrame.shape[1], finishedFrame.shape[0], QImage.Format_RGB888 if (color == 0) else QImage.Format_Grayscale8))
+                result = False
+            elif ret:
+                self.recording(frame)
+                result = self.nextBuffer(vp.outputShape(frame, color, scale))
+                self.converter.convert(frame, color, scale, result[0])
             else:
                 self.finish()
         except Exception as e:
@@ -172,12 +287,265 @@ class CameraStreamObject(QObject):
         finally:
             return result
 
+    def nextBuffer(self, shape):
+        """
+        Returns a pool entry which is neither waiting in the slot nor being shown, the pool is reallocated when the shape changes.
+        """
+        if (not self.pool) or (self.pool[0][0].shape != shape):
+            self.pool = [createFrameBuffer(shape) for _ in range(THREADING_FRAME_POOL)]
+
+        with self.frameLock:
+            for entry in self.pool:
+                if (entry is not self.frame) and (entry is not self.reading):
+                    return entry
+
+    def capture(self):
+        """
+        Capture worker, decodes as fast as the source delivers and keeps only the latest frame.
+        """
+        global THREADING_SHUTDOWN, THREADING_SUSPEND_TIME
+        while not THREADING_SHUTDOWN and not self.stopped:
+            start = time.perf_counter()
+            frame = self.decode()
+            if frame is None:
+                time.sleep(THREADING_SUSPEND_TIME) # Nothing to read, wait for a refresh or retry opening later.
+                continue
+            if frame is False:
+                self.skipped += 1
+                continue
+
+            self.decodeTime += ((time.perf_counter() - start) - self.decodeTime) * THREADING_DECODE_GAIN
+            self.captured += 1
+            with self.frameLock:
+                if (self.frame is not None) and self.visible:
+                    self.dropped += 1 # Compositor never took the previous one.
+                self.frame = frame
+            self.frameReady.set()
+
+        self.closeStream()
+        if self.replay:
+            self.replay.close()
+
+    def take(self):
+        """
+        Take the latest frame as a pixmap, never waits for the worker, returns None if there is no new frame.
+        """
+        with self.frameLock:
+            frame = self.frame
+            self.frame = None
+            self.reading = frame
+
+        if frame is None:
+            return None
+
+        result = QPixmap.fromImage(frame[1])
+        with self.frameLock:
+            self.reading = None
+        return result
+
+    def getStatistics(self, now):
+        """
+        Returns capture fps, decode time (sec.) and dropped frames.
+        """
+        elapsed = (now - self.lastFpsTime)
+        if elapsed > 0:
+            self.fps = (self.captured - self.lastFpsCount) / elapsed
+        self.lastFpsTime, self.lastFpsCount = now, self.captured
+        return {
+            "fps": self.fps,
+            "decode": self.decodeTime,
+            "captured": self.captured,
+            "dropped": self.dropped,
+            "skipped": self.skipped,
+            "discarded": self.discarded,
+            "recording": self.recorder.getStatistics() if self.recorder else None,
+            "replay": self.replay.getStatistics() if self.replay else None
+        }
+
+class CameraProcessObject():
+    """
+    Same interface as CameraStreamObject, but the stream is decoded in its own process, frames arrive through a shared memory ring.
+    """
+    def __init__(self, id, obj):
+        self.id = id
+        self.obj = obj
+        self.events = CameraEvents()
+        self.visible = True # Frames of hidden/minimized windows are not delivered.
+        self.rec = False
+        self.refresh = False
+        self.stopped = False
+        self.lock = threading.Lock() # take() vs stop(), the ring must not be released while a frame is converted.
+        self.process = None
+        self.conn = None
+        self.ring = None
+        self.images = None # QImage per ring slot.
+        self.lastSeq = 0
+        self.sentRec = False
+        self.sentParams = None
+
+        # Capture statistics.
+        self.dropped = 0
+        self.fps = 0.0
+        self.lastFpsTime = time.time()
+        self.lastFpsCount = 0
+
+    def __del__(self):
+        self.stop()
+
+    def params(self):
+        return (self.obj["source"], self.obj["color"], tuple(self.obj["scaling"]), self.obj["lowLatency"], self.obj["replay"])
+
+    def start(self, frameReady):
+        self.conn, child = vp.DECODER_CONTEXT.Pipe()
+        self.sentParams = self.params()
+        self.process = vp.DECODER_CONTEXT.Process(target=vp.decodeProcess, args=(self.id, self.sentParams, child, frameReady, vr.getSegmentLimits(), vr.getReplaySettings()), name="Decode {}".format(self.id), daemon=True)
+        self.process.start()
+        child.close()
+
+    def send(self, command):
+        try:
+            self.conn.send(command)
+        except (BrokenPipeError, OSError) as e:
+            print(e)
+
+    def stop(self):
+        """
+        Tell the decoder process to exit, a decoder stuck in a blocking read is terminated when the app exits.
+        """
+        with self.lock:
+            if self.stopped:
+                return
+            self.stopped = True
+            if self.conn:
+                self.send(("stop",))
+            self.images = None
+            if self.ring:
+                self.ring.close(unlink=True)
+                self.ring = None
+
+    def setVisible(self, visible):
+        """
+        Hidden streams are not taken by the compositor, so the decoder is told right away.
+        """
+        with self.lock:
+            self.visible = visible
+            if self.conn and not self.stopped:
+                self.send(("visible", visible))
+
+    def requestReplayFrame(self, secondsBack):
+        """
+        The decoder holds the replay, the frame arrives with the next poll.
+        """
+        with self.lock:
+            if self.conn and not self.stopped:
+                self.send(("replayFrame", secondsBack))
+
+    def saveReplay(self):
+        with self.lock:
+            if self.conn and not self.stopped:
+                self.send(("replaySave",))
+
+    def poll(self):
+        """
+        Handle msgs. from the decoder process, a new ring whenever the frame shape changed or the stream finished.
+        """
+        while self.conn.poll():
+            msg = self.conn.recv()
+            if msg[0] == "ring":
+                self.images = None # Must be gone before the ring can be closed.
+                if self.ring:
+                    self.ring.close()
+                try:
+                    self.ring = vp.FrameRing(name=msg[1])
+                    self.images = [wrapFrame(f) for f in self.ring.frames]
+                except FileNotFoundError: # Superseded already, the next msg. has the new one.
+                    self.ring = None
+                self.lastSeq = 0
+            elif msg[0] == "finished":
+                self.events.dispatchFinishedEvent(self.id)
+            elif (msg[0] == "replayFrame") and msg[1]:
+                self.events.dispatchReplayEvent(replayPixmap(msg[1][1], self.obj["color"]), msg[1][0])
+
+    def take(self):
+        """
+        Take the latest frame as a pixmap, never waits for the decoder, returns None if there is no new frame.
+        """
+        with self.lock:
+            if self.stopped:
+                return None
+
+            try:
+                self.poll()
+            except (EOFError, OSError): # Decoder process is gone.
+                return None
+
+            # Forward changes from the window.
+            params = self.params()
+            if self.refresh:
+                self.refresh = False
+                self.sentParams = params
+                self.send(("refresh", params))
+            elif params != self.sentParams:
+                self.sentParams = params
+                self.send(("config", params))
+            if self.rec != self.sentRec:
+                self.sentRec = self.rec
+                self.send(("record", self.rec))
+
+            ring = self.ring
+            if ring is None:
+                return None
+
+            seq = int(ring.header[vp.RING_SEQ])
+            if seq == self.lastSeq:
+                return None
+            if self.lastSeq > 0:
+                self.dropped += maxVal(seq - self.lastSeq - 1, 0)
+            self.lastSeq = seq
+
+            result = QPixmap.fromImage(self.images[(seq - 1) % ring.slots])
+            if (int(ring.header[vp.RING_SEQ]) - seq) >= (ring.slots - 1): # Overwritten while converting.
+                self.dropped += 1
+                return None
+            return result
+
+    def getStatistics(self, now):
+        """
+        Returns capture fps, decode time (sec.) and dropped frames.
+        """
+        ring = self.ring
+        captured = int(ring.header[vp.RING_CAPTURED]) if ring else self.lastFpsCount
+        skipped = int(ring.header[vp.RING_SKIPPED]) if ring else 0
+        discarded = int(ring.header[vp.RING_DISCARDED]) if ring else 0
+        recording = None
+        if ring and ring.header[vp.RING_RECORDING]:
+            recording = {"written": int(ring.header[vp.RING_RECORD_WRITTEN]), "dropped": int(ring.header[vp.RING_RECORD_DROPPED]), "backlog": int(ring.header[vp.RING_RECORD_BACKLOG])}
+        replay = None
+        if ring and self.obj["replay"] and (vr.REPLAY_SECONDS > 0):
+            replay = {"seconds": int(ring.header[vp.RING_REPLAY_MSEC]) / 1000, "bytes": int(ring.header[vp.RING_REPLAY_BYTES])}
+        elapsed = (now - self.lastFpsTime)
+        if elapsed > 0:
+            self.fps = maxVal(captured - self.lastFpsCount, 0) / elapsed
+        self.lastFpsTime, self.lastFpsCount = now, captured
+        return {
+            "fps": self.fps,
+            "decode": float(ring.decodeTime[0]) if ring else 0.0,
+            "captured": captured,
+            "dropped": self.dropped,
+            "skipped": skipped,
+            "discarded": discarded,
+            "recording": recording,
+            "replay": replay
+        }
+
 class CameraSync(QObject):
-    def __init__(self):
+    def __init__(self, process=False):
         super().__init__()
         self.shutdown = False  
+        self.process = process # Decode every stream in its own process?
         self.items = dict()
-        self.lock = threading.Lock()
+        self.lock = threading.Lock() # Guards the stream list only, never held while capturing.
+        self.frameReady = (vp.DECODER_CONTEXT.Event() if process else threading.Event())
         self.thread = QThread()
         self.moveToThread(self.thread)
         self.thread.started.connect(self.run)
@@ -190,14 +558,20 @@ class CameraSync(QObject):
         self.thread = None
 
     def add(self, id, obj):
+        stream = (CameraProcessObject(id, obj) if self.process else CameraStreamObject(id, obj))
         with self.lock:
-            self.items[id] = CameraStreamObject(id, obj)
+            old = self.items.pop(id, None)
+            self.items[id] = stream
+        if old:
+            old.stop()
+        stream.start(self.frameReady)
+        return stream.events
 
     def remove(self, id):
         with self.lock:
-            if id in self.items:
-                obj = self.items.pop(id)
-                obj.closeStream()
+            obj = self.items.pop(id, None)
+        if obj:
+            obj.stop() # The worker releases the stream itself.
 
     def record(self, id):
         with self.lock:        
@@ -209,26 +583,61 @@ class CameraSync(QObject):
             if id in self.items:
                 self.items[id].refresh = True
 
+    def replayFrame(self, id, secondsBack):
+        with self.lock:
+            obj = self.items.get(id)
+        if obj:
+            obj.requestReplayFrame(secondsBack)
+            self.frameReady.set() # Poll the decoder process soon.
+
+    def saveReplay(self, id):
+        with self.lock:
+            obj = self.items.get(id)
+        if obj:
+            obj.saveReplay()
+
+    def setVisible(self, id, visible):
+        """
+        Frames are only delivered to visible windows, hidden/minimized ones are skipped.
+        """
+        with self.lock:
+            if id in self.items:
+                self.items[id].setVisible(visible)
+        if visible:
+            self.frameReady.set() # Deliver the latest frame right away.
+
     def run(self):
-        global THREADING_SHUTDOWN, THREADING_EVENTS, THREADING_SUSPEND_TIME
-        frames = dict()
+        global THREADING_SHUTDOWN, THREADING_SUSPEND_TIME
+        lastStatistics = time.time()
         while not THREADING_SHUTDOWN and not self.shutdown:
+            # Wake up as soon as any worker has a new frame, suspend otherwise, if nothing else to do!
+            self.frameReady.wait(THREADING_SUSPEND_TIME)
+            self.frameReady.clear()
             with self.lock:
-                for id, obj in self.items.items():
-                    frame = obj.render()
-                    if frame:
-                        frames[id] = frame
+                items = [obj for obj in self.items.values() if obj.visible]
 
-            # Send pixmap to ui thread, suspend otherwise, if nothing else to do!
-            THREADING_EVENTS.dispatchPixmapEvent(frames.copy()) if len(frames) > 0 else time.sleep(THREADING_SUSPEND_TIME) 
-            frames.clear()
-        self.items.clear()
+            # Send each pixmap to the window of its stream only.
+            for obj in items:
+                frame = obj.take()
+                if frame:
+                    obj.events.dispatchPixmapEvent(frame)
+
+            now = time.time()
+            if (now - lastStatistics) >= THREADING_STATISTICS_INTERVAL:
+                lastStatistics = now
+                for obj in items:
+                    obj.events.dispatchStatisticsEvent(obj.getStatistics(now))
+
+        with self.lock:
+            for obj in self.items.values():
+                obj.stop()
+            self.items.clear()
 
-def initialize(val):
+def initialize(val, process=False):
     """
     Determine threading mode!
     """
     global THREADING_SYNC, THREADING_SHUTDOWN
     THREADING_SHUTDOWN = False
-    THREADING_SYNC = (CameraSync() if (not val) else None)
+    THREADING_SYNC = (CameraSync(process) if (not val) else None)
     
@@ -1,12 +1,14 @@
 """ Video Cam Stream Window """
 
-from PyQt5.QtCore import QTimer, QThread, pyqtSignal, Qt, pyqtSlot, QObject, QRect, QPoint
+from PyQt5.QtCore import QTimer, QThread, pyqtSignal, Qt, pyqtSlot, QObject, QRect, QPoint, QEvent
 from PyQt5.QtWidgets import QApplication, QDialog, QMainWindow, QSizePolicy
 from PyQt5.QtGui import QImage, QPixmap
 from PyQt5.uic import loadUi
 
 from camera import video_manager as vm
 from camera import video_threading as vt
+from camera import video_recording as vr
+from camera import video_latency as vl
 from utils.math import clamp
 
 class CameraStreamWindow(QMainWindow):
@@ -18,6 +20,9 @@ class CameraStreamWindow(QMainWindow):
         self.setWindowTitle(id)
         self.id = id
         self.recording = False
+        self.scrubbing = False # Live frames are held back while a replay frame is shown.
+        self.probe = None # Glass-to-glass measurement in progress.
+        self.latency = "" # Result of the last measurement.
 
         self.pixmap.setSizePolicy(QSizePolicy.Ignored, QSizePolicy.Ignored)
 
@@ -26,13 +31,30 @@ class CameraStreamWindow(QMainWindow):
         self.colorChoices.currentIndexChanged.connect(self.propertyChange)
         self.scaleChoices.currentIndexChanged.connect(self.propertyChange)
         self.btnToggleFunctions.clicked.connect(self.toggleFunctions)
+        self.chkLowLatency.toggled.connect(self.lowLatencyChange)
+        self.btnLatency.clicked.connect(self.measureLatency)
         self.btnToggleFunctions.hide()
 
-        vt.THREADING_EVENTS.pixmap.connect(self.receiveFrame)
-        vt.THREADING_EVENTS.finished.connect(self.finished)
-
-        self.syncObject = (vt.CameraSync() if vm.VIDEO_MULTI_THREAD else vt.THREADING_SYNC)
-        self.syncObject.add(self.id, self.cameraObject)
+        self.syncObject = (vt.CameraSync(vm.VIDEO_MULTI_PROCESS) if vm.VIDEO_MULTI_THREAD else vt.THREADING_SYNC)
+        events = self.syncObject.add(self.id, self.cameraObject)
+        events.pixmap.connect(self.receiveFrame)
+        events.finished.connect(self.finished)
+        events.statistics.connect(self.receiveStatistics)
+        events.replay.connect(self.receiveReplayFrame)
+
+        # Instant replay, the slider goes back in 0.1 sec. steps, 0 is live.
+        self.replaySlider.setRange(-int(vr.REPLAY_SECONDS * 10), 0)
+        self.replaySlider.setValue(0)
+        self.replaySlider.valueChanged.connect(self.scrub)
+        self.btnSaveReplay.clicked.connect(self.saveReplay)
+        self.chkReplay.setChecked(obj["replay"])
+        self.chkReplay.toggled.connect(self.replayChange)
+        self.replayChange(obj["replay"])
+        if vr.REPLAY_SECONDS <= 0:
+            self.chkReplay.hide()
+            self.lblReplay.hide()
+            self.replaySlider.hide()
+            self.btnSaveReplay.hide()
 
         # Set properties
         bounds = obj["bounds"]
@@ -48,6 +70,7 @@ class CameraStreamWindow(QMainWindow):
                     break
 
         self.sourceField.setText(src)
+        self.chkLowLatency.setChecked(obj["lowLatency"])
         self.colorChoices.setCurrentIndex(clamp(color, 0, (self.colorChoices.count() - 1)))
 
         # Update proportions
@@ -61,6 +84,10 @@ class CameraStreamWindow(QMainWindow):
         self.cameraObject["bounds"] = (self.pos().x(), self.pos().y(), self.size().width(), self.size().height())
         vm.update(self.id, self.cameraObject)       
         
+        if self.probe:
+            self.probe.close()
+            self.probe = None
+
         self.syncObject.remove(self.id)
         self.syncObject = None
         self.cameraObject["window"] = None
@@ -68,6 +95,21 @@ class CameraStreamWindow(QMainWindow):
 
         super().closeEvent(event)
 
+    def showEvent(self, event):
+        super().showEvent(event)
+        if self.syncObject:
+            self.syncObject.setVisible(self.id, not self.isMinimized())
+
+    def hideEvent(self, event):
+        super().hideEvent(event)
+        if self.syncObject:
+            self.syncObject.setVisible(self.id, False)
+
+    def changeEvent(self, event):
+        super().changeEvent(event)
+        if (event.type() == QEvent.WindowStateChange) and self.syncObject:
+            self.syncObject.setVisible(self.id, self.isVisible() and not self.isMinimized())
+
     def enterEvent(self, event):
         self.btnToggleFunctions.show()
 
@@ -79,6 +121,26 @@ class CameraStreamWindow(QMainWindow):
         self.btnRecord.setText("Stop Recording" if self.recording else "Start Recording")
         self.syncObject.record(self.id)
             
+    def replayChange(self, checked):
+        """
+        The replay is picked up by the capture worker/decoder with the next frame.
+        """
+        self.cameraObject["replay"] = checked
+        if not checked:
+            self.replaySlider.setValue(0)
+        self.replaySlider.setEnabled(checked)
+        self.btnSaveReplay.setEnabled(checked)
+
+    def scrub(self, value):
+        self.scrubbing = (value < 0)
+        if self.scrubbing:
+            self.syncObject.replayFrame(self.id, -value / 10)
+        else:
+            self.lblReplay.setText("Live")
+
+    def saveReplay(self):
+        self.syncObject.saveReplay(self.id)
+
     def propertyChange(self):
         """
         Triggered whenever color or scaling is changed!
@@ -87,6 +149,26 @@ class CameraStreamWindow(QMainWindow):
         self.cameraObject["color"] = self.colorChoices.currentIndex()
         self.cameraObject["scaling"] = vm.getResolution("({},{})".format(scale[0], scale[1])) if len(scale) >= 2 else (0, 0) 
 
+    def lowLatencyChange(self, checked):
+        """
+        Capture buffering is set when the stream is opened, reopen it.
+        """
+        if self.cameraObject["lowLatency"] != checked:
+            self.cameraObject["lowLatency"] = checked
+            self.syncObject.refresh(self.id)
+
+    def measureLatency(self):
+        if self.probe:
+            self.probe.close()
+        self.probe = vl.LatencyProbe(self.id, self.latencyMeasured)
+        self.probe.show()
+        self.btnLatency.setEnabled(False)
+
+    def latencyMeasured(self, text):
+        self.probe = None
+        self.latency = text
+        self.btnLatency.setEnabled(True)
+
     def update(self):
         """
         Tell threading to update source and other stuff if needed!
@@ -100,10 +182,31 @@ class CameraStreamWindow(QMainWindow):
             self.recording = False
             self.btnRecord.setText("Start Recording")
 
+    @pyqtSlot(QPixmap)
+    def receiveFrame(self, frame):
+        if not self.scrubbing:
+            self.pixmap.setPixmap(frame)
+            if self.probe:
+                self.probe.frame(frame)
+
+    @pyqtSlot(QPixmap, float)
+    def receiveReplayFrame(self, frame, age):
+        if self.scrubbing:
+            self.pixmap.setPixmap(frame)
+            self.lblReplay.setText("-{:.1f} s".format(age))
+
     @pyqtSlot(dict)
-    def receiveFrame(self, frames):
-        if frames and (self.id in frames):
-            self.pixmap.setPixmap(frames[self.id])
+    def receiveStatistics(self, s):
+        text = "Capture {:.1f} fps, decode {:.1f} ms, {} dropped".format(s["fps"], s["decode"] * 1000, s["dropped"])
+        if self.cameraObject and self.cameraObject["lowLatency"]:
+            text += ", {} stale".format(s["discarded"])
+        if self.latency:
+            text += " | " + self.latency
+        if s.get("recording"):
+            text += " | Recording backlog {}, {} dropped".format(s["recording"]["backlog"], s["recording"]["dropped"])
+        if s.get("replay"):
+            text += " | Replay {:.1f} s, {:.1f} MB".format(s["replay"]["seconds"], s["replay"]["bytes"] / (1024 * 1024))
+        self.lblStatistics.setText(text)
 
     def toggleFunctions(self):
         """ Toggle to show/hide video functions, record will be unaffected """
@@ -0,0 +1,98 @@
+""" Raw telemetry capture files, every datagram received from the rover is appended together with its receive time """
+
+import struct
+
+CAPTURE_MAGIC = b"MCCAP1" # File header, format version 1.
+CAPTURE_RECORD = struct.Struct("<dI") # Receive time (unix time, sec.) + datagram size.
+REPLAY_SPEED_UNLIMITED = 0 # Replay as fast as possible.
+
+class CaptureWriter():
+    """
+    Appends raw datagrams to a capture file, a header is only written to a new/empty file.
+    """
+    def __init__(self, path):
+        self.file = open(path, "ab")
+        if self.file.tell() == 0:
+            self.file.write(CAPTURE_MAGIC)
+        self.records = 0
+
+    def __del__(self):
+        self.close()
+
+    def write(self, data, received):
+        data = bytes(data)
+        self.file.write(CAPTURE_RECORD.pack(received, len(data)))
+        self.file.write(data)
+        self.records += 1
+
+    def close(self):
+        if self.file:
+            self.file.close()
+            self.file = None
+
+def readCapture(path):
+    """
+    Yields (receive time, datagram) for every record in the capture file.
+    """
+    with open(path, "rb") as f:
+        if f.read(len(CAPTURE_MAGIC)) != CAPTURE_MAGIC:
+            raise ValueError("{} is not a telemetry capture file!".format(path))
+
+        while True:
+            header = f.read(CAPTURE_RECORD.size)
+            if len(header) < CAPTURE_RECORD.size:
+                return # EOF or the capture was cut off while recording.
+
+            received, size = CAPTURE_RECORD.unpack(header)
+            data = f.read(size)
+            if len(data) < size:
+                return
+            yield received, data
+
+class CaptureReplay():
+    """
+    Replays a capture file with the original timing, scaled by speed, or as fast as possible (speed = 0).
+    """
+    def __init__(self, path, speed=1.0):
+        self.records = readCapture(path)
+        self.speed = speed
+        self.start = None # Wall clock + capture time of the first record.
+        self.first = None
+        self.next = next(self.records, None)
+        self.clock = self.next[0] if self.next else 0.0 # Capture time of the last record replayed.
+        self.replayed = 0
+
+    def finished(self):
+        return self.next is None
+
+    def dueTime(self, received):
+        """
+        Wall clock time at which a record should be replayed.
+        """
+        if self.speed <= REPLAY_SPEED_UNLIMITED:
+            return 0.0
+        return self.start + ((received - self.first) / self.speed)
+
+    def timeUntilNext(self, now):
+        if self.next is None:
+            return 0.0
+        if self.start is None:
+            return 0.0
+        return max(self.dueTime(self.next[0]) - now, 0.0)
+
+    def poll(self, now, limit):
+        """
+        Returns up to limit records which are due, as (capture time, datagram).
+        """
+        if self.start is None and self.next:
+            self.start = now
+            self.first = self.next[0]
+
+        output = list()
+        while self.next and (len(output) < limit) and (self.dueTime(self.next[0]) <= now):
+            output.append(self.next)
+            self.clock = self.next[0]
+            self.next = next(self.records, None)
+
+        self.replayed += len(output)
+        return output
@@ -0,0 +1,76 @@
+""" Histogram of the round-trip time from gamepad input to the rover's acknowledgement """
+
+import csv
+from collections import deque
+
+COMMAND_LATENCY_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000) # Upper bucket edges in msec, the last bucket holds everything above.
+COMMAND_LATENCY_SAMPLES = 1000 # Recent samples kept for the percentiles.
+
+class LatencyHistogram():
+    def __init__(self, buckets=COMMAND_LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.reset()
+
+    def reset(self):
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+        self.samples = deque(maxlen=COMMAND_LATENCY_SAMPLES)
+
+    def add(self, ms):
+        idx = 0
+        while idx < len(self.buckets) and ms > self.buckets[idx]:
+            idx += 1
+        self.counts[idx] += 1
+        self.count += 1
+        self.total += ms
+        self.min = ms if self.min is None else min(self.min, ms)
+        self.max = ms if self.max is None else max(self.max, ms)
+        self.samples.append(ms)
+
+    def percentile(self, p):
+        if not self.samples:
+            return 0.0
+        ordered = sorted(self.samples)
+        return ordered[min(int(len(ordered) * p / 100), len(ordered) - 1)]
+
+    def get(self):
+        """
+        Returns a snapshot, safe to pass to another thread.
+        """
+        return {
+            "buckets": list(self.buckets),
+            "counts": list(self.counts),
+            "count": self.count,
+            "min": self.min if self.min is not None else 0.0,
+            "max": self.max if self.max is not None else 0.0,
+            "mean": (self.total / self.count) if self.count > 0 else 0.0,
+            "p50": self.percentile(50),
+            "p95": self.percentile(95),
+            "p99": self.percentile(99)
+        }
+
+def getBucketLabels(snapshot):
+    """
+    Human readable label per bucket, e.g. '5-10'.
+    """
+    edges = snapshot["buckets"]
+    labels = ["<{}".format(edges[0])]
+    labels += ["{}-{}".format(edges[i - 1], edges[i]) for i in range(1, len(edges))]
+    labels.append(">{}".format(edges[-1]))
+    return labels
+
+def exportCsv(snapshot, path):
+    """
+    Write a histogram snapshot to a csv file, one row per bucket followed by the summary.
+    """
+    with open(path, "w", newline="") as f:
+        w = csv.writer(f)
+        w.writerow(("bucket (ms)", "count"))
+        for label, count in zip(getBucketLabels(snapshot), snapshot["counts"]):
+            w.writerow((label, count))
+        w.writerow(())
+        for key in ("count", "min", "max", "mean", "p50", "p95", "p99"):
+            w.writerow((key, snapshot[key]))
@@ -1,10 +1,11 @@
 """ SQLAlchemy Definitions + Session Creation (using PostgreSQL) """
 
-import threading, time
+import threading, time, queue, io, csv
+from contextlib import contextmanager
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy import create_engine, Column, Integer, BIGINT, String, SMALLINT, TIMESTAMP, MetaData, desc, and_, or_
 from sqlalchemy.orm import sessionmaker, scoped_session
-from PyQt5.QtCore import QObject, pyqtSignal
+from PyQt5.QtCore import QObject, QThread, pyqtSignal
 import settings
 from utils import event
 
@@ -16,10 +17,42 @@ PASSWD = None
 USEMYSQL = False
 
 engine = None
+WRITER = None
 Base = declarative_base()
-Session = scoped_session(sessionmaker())
+Session = scoped_session(sessionmaker()) # Thread-local sessions, each thread checks out its own pooled connection.
 
-LOCK = threading.Lock() # Only one thread can use a DB session at a time... SAD!
+POOL_SIZE = 5 # Persistent connections kept in the pool.
+POOL_OVERFLOW = 10 # Extra connections allowed when the pool is exhausted.
+POOL_TIMEOUT = 30 # Max sec. to wait for a connection from the pool.
+
+class PoolStatistics():
+    """
+    Keeps track of how long threads had to wait to check out a pooled connection.
+    """
+    def __init__(self):
+        self.lock = threading.Lock() # Only guards the counters, never held during a query.
+        self.checkouts = 0
+        self.lastWait = 0.0
+        self.maxWait = 0.0
+        self.totalWait = 0.0
+
+    def addCheckout(self, wait):
+        with self.lock:
+            self.checkouts += 1
+            self.lastWait = wait
+            self.maxWait = max(self.maxWait, wait)
+            self.totalWait += wait
+
+    def get(self):
+        with self.lock:
+            return {
+                "checkouts": self.checkouts,
+                "lastWait": self.lastWait,
+                "maxWait": self.maxWait,
+                "averageWait": (self.totalWait / self.checkouts) if self.checkouts > 0 else 0.0
+            }
+
+POOL_STATISTICS = PoolStatistics()
 
 STATUS_SIGNAL_RATE_LIMIT = 0.5 # Only emit every X sec.
 class DBStatusSignal(QObject):
@@ -40,71 +73,128 @@ class DBStatusSignal(QObject):
 
 SIGNAL = DBStatusSignal()
 
+def createEngine(db):
+    """
+    Create a pooled engine for the desired DB, using the current connection settings.
+    """
+    return create_engine("{}{}:{}@{}:{}/{}".format("mysql+pymysql://" if USEMYSQL else "postgresql://", USERNAME, PASSWD, ADDRESS, PORT, db),
+                         pool_size=POOL_SIZE, max_overflow=POOL_OVERFLOW, pool_timeout=POOL_TIMEOUT)
+
+def swapEngine(newEngine):
+    """
+    Point new sessions at a new engine. Queries in flight keep their connection from the old pool,
+    disposing only closes the idle connections, checked out ones are closed once they are returned.
+    """
+    global Session, engine
+    oldEngine = engine
+    engine = newEngine
+    Session = scoped_session(sessionmaker(bind=newEngine))
+    if oldEngine:
+        oldEngine.dispose()
+
 def onSettingsChanged(name, config): # Deals with reconnecting the engine for new db settings.
-    global ADDRESS, PORT, DB, USERNAME, PASSWD, USEMYSQL, Session, engine
+    global ADDRESS, PORT, DB, USERNAME, PASSWD, USEMYSQL, POOL_SIZE, POOL_OVERFLOW, POOL_TIMEOUT
     ADDRESS = config.get("database", "address")
     PORT = config.get("database", "port")
     DB = config.get("database", "db")
     USERNAME = config.get("database", "user")
     PASSWD = config.get("database", "passwd")    
-    with LOCK: # Update connection itself... WAIT for other queries to finish via the lock.
-        USEMYSQL = (config.get("database", "type") == "mysql")
-        if engine:
-            engine.dispose()
-            Session.remove()
-            Session = scoped_session(sessionmaker())
-        engine = create_engine("{}{}:{}@{}:{}/{}".format("mysql+pymysql://" if USEMYSQL else "postgresql://", USERNAME, PASSWD, ADDRESS, PORT, DB))
-        Session.configure(bind=engine)
+    USEMYSQL = (config.get("database", "type") == "mysql")
+    POOL_SIZE = int(config.get("database", "poolSize", fallback=POOL_SIZE))
+    POOL_OVERFLOW = int(config.get("database", "poolOverflow", fallback=POOL_OVERFLOW))
+    POOL_TIMEOUT = float(config.get("database", "poolTimeout", fallback=POOL_TIMEOUT))
+    swapEngine(createEngine(DB))
+
+@contextmanager
+def sessionScope():
+    """
+    Yield a session for the calling thread, the time spent waiting for a pooled connection is recorded.
+    """
+    s = Session()
+    try:
+        start = time.perf_counter()
+        s.connection() # Checks out the connection, blocks if the pool is exhausted.
+        POOL_STATISTICS.addCheckout(time.perf_counter() - start)
+        yield s
+    finally:
+        s.close()
+
+def getPoolStatistics():
+    """
+    Returns checkout wait times along with the current pool usage.
+    """
+    stats = POOL_STATISTICS.get()
+    pool = engine.pool if engine else None
+    stats["size"] = pool.size() if pool else 0
+    stats["checkedOut"] = pool.checkedout() if pool else 0
+    stats["overflow"] = pool.overflow() if pool else 0
+    return stats
 
 def loadDatabase():
+    global WRITER
     settings.settings.SETTINGSEVENT.addListener(onSettingsChanged, onSettingsChanged)
     onSettingsChanged(None, settings.settings.SETTINGS)          
+    WRITER = TelemetryWriter()
+    WRITER.start()
+
+def shutdownDatabase():
+    """
+    Flush the remaining telemetry and stop the writer.
+    """
+    global WRITER
+    if WRITER is None:
+        return
+
+    WRITER.destroy()
+    WRITER = None
+
+def addTelemetry(msg, s, t, time):
+    """
+    Queue a new telemetry event for the writer, never blocks the caller.
+    Returns false if the row was dropped.
+    """
+    if WRITER is None:
+        return False
+    return WRITER.put(msg, s, t, time)
 
 def add(el):
     """Generic Add"""
-    s = None
-    with LOCK:
-        try:
-            s = Session()
-            s.add(el)
-            s.commit()
-            SIGNAL.dispatch(True)
-        except Exception as e:
-            print(e)
-            SIGNAL.dispatch(False, e)
-            if s:
-                s.rollback()  
-        finally:
-            if s:
-                s.close()
+    try:
+        with sessionScope() as s:
+            try:
+                s.add(el)
+                s.commit()
+                SIGNAL.dispatch(True)
+            except:
+                s.rollback()
+                raise
+    except Exception as e:
+        print(e)
+        SIGNAL.dispatch(False, e)
 
 def delete(el):
     """Generic Delete"""
-    s = None
-    with LOCK:
-        try:
-            s = Session()
-            s.delete(el)
-            s.commit()
-            SIGNAL.dispatch(True)
-        except Exception as e:
-            print(e)
-            SIGNAL.dispatch(False, e)
-            if s:
-                s.rollback()    
-        finally:
-            if s:
-                s.close()
+    try:
+        with sessionScope() as s:
+            try:
+                s.delete(el)
+                s.commit()
+                SIGNAL.dispatch(True)
+            except:
+                s.rollback()
+                raise
+    except Exception as e:
+        print(e)
+        SIGNAL.dispatch(False, e)
 
 def find(id):
     """Generic Find"""
-    with LOCK:
-        try:
-            s = Session()
+    try:
+        with sessionScope() as s:
             return s.query(Event).filter_by(id=id).first()
-        except Exception as e:
-            print(e)
-            return None
+    except Exception as e:
+        print(e)
+        return None
 
 class Event(Base):
     __tablename__ = "event"
@@ -134,108 +224,214 @@ class Event(Base):
     @staticmethod
     def findAll(reverse=False):
         output = list()    
-        with LOCK:
-            try:
-                s = Session()
+        try:
+            with sessionScope() as s:
                 for d in s.query(Event).order_by(desc(Event.time)).all():
                     output.append(d)
-            except Exception as e:
-                print(e)
-            finally:
-                if reverse:
-                    output.reverse()
-                return output
+        except Exception as e:
+            print(e)
+        finally:
+            if reverse:
+                output.reverse()
+            return output
 
     @staticmethod
     def findByType(t, reverse=False):
         output = list()    
-        with LOCK:
-            try:
-                s = Session()
+        try:
+            with sessionScope() as s:
                 for d in s.query(Event).filter_by(type=t).order_by(desc(Event.time)).all():
                     output.append(d)
-            except Exception as e:
-                print(e)
-            finally:
-                if reverse:
-                    output.reverse()
-                return output
+        except Exception as e:
+            print(e)
+        finally:
+            if reverse:
+                output.reverse()
+            return output
 
     @staticmethod
     def findTypeWithin(t, start, end, reverse=False):
         output = list()    
-        with LOCK:
-            try:
-                s = Session()
+        try:
+            with sessionScope() as s:
                 for d in s.query(Event).filter(Event.time >= start, Event.time <= end, Event.type == t).order_by(desc(Event.time)).all():
                     output.append(d)
-            except Exception as e:
-                print(e)
-            finally:
-                if reverse:
-                    output.reverse()
-                return output
-
-def deleteDataFromDatabase():
-    """Delete all data!"""
-    s = None
-    with LOCK:
-        try:
-            s = Session()                 
-            
-            # Delete actual table data here:
-            s.query(Event).delete() # Delete all events.
-
-            # Commit changes!
-            s.commit()
-            SIGNAL.dispatch(True)
         except Exception as e:
             print(e)
-            SIGNAL.dispatch(False, e)
-            if s:
-                s.rollback()    
         finally:
-            if s:
-                s.close()
+            if reverse:
+                output.reverse()
+            return output
 
-def createTables():
+def deleteDataFromDatabase():
+    """Delete all data!"""
+    try:
+        with sessionScope() as s:
+            try:
+                # Delete actual table data here:
+                s.query(Event).delete() # Delete all events.
+
+                # Commit changes!
+                s.commit()
+                SIGNAL.dispatch(True)
+            except:
+                s.rollback()
+                raise
+    except Exception as e:
+        print(e)
+        SIGNAL.dispatch(False, e)
+
+def createTables(target=None):
     """
     Create all the necessary tables for the DB.
     """
     global engine, Base
-    Base.metadata.create_all(engine, tables=[Event.__table__])
+    Base.metadata.create_all(target if target else engine, tables=[Event.__table__])
 
 def createDatabase(db):
     """
     Create a fully functional MySQL or PostgreSQL DB + table(s).
     """
-    global ADDRESS, PORT, DB, USERNAME, PASSWD, USEMYSQL, Session, engine
-
-    with LOCK:
-        # Dispose of old DB connection + session.
-        DB = db
-        if engine:
-            engine.dispose()
-            Session.remove()
-            Session = scoped_session(sessionmaker())
-
-        # Connect to default / public DB -> Create new DB!
-        engine = create_engine("{}{}:{}@{}:{}/{}".format("mysql+pymysql://" if USEMYSQL else "postgresql://", USERNAME, PASSWD, ADDRESS, PORT,  "" if USEMYSQL else "postgres"))
-        conn = engine.connect()
-        conn.execute("commit")
-        conn.execute("CREATE DATABASE {}".format(db))
-        conn.close()       
-        engine.dispose()
-
-        # Connect to the new DB + create new tables.      
-        engine = create_engine("{}{}:{}@{}:{}/{}".format("mysql+pymysql://" if USEMYSQL else "postgresql://", USERNAME, PASSWD, ADDRESS, PORT, db))
-        createTables()
-        time.sleep(1)
-        engine.dispose()
-
-        # Establish new session + refresh.
-        engine = create_engine("{}{}:{}@{}:{}/{}".format("mysql+pymysql://" if USEMYSQL else "postgresql://", USERNAME, PASSWD, ADDRESS, PORT, DB))
-        Session.configure(bind=engine)
+    global DB
+
+    # Connect to default / public DB -> Create new DB!
+    setupEngine = createEngine("" if USEMYSQL else "postgres")
+    conn = setupEngine.connect()
+    conn.execute("commit")
+    conn.execute("CREATE DATABASE {}".format(db))
+    conn.close()       
+    setupEngine.dispose()
+
+    # Connect to the new DB + create new tables.      
+    newEngine = createEngine(db)
+    createTables(newEngine)
+    time.sleep(1)
+
+    # Swap over to the new DB, the current one keeps serving queries in flight.
+    DB = db
+    swapEngine(newEngine)
+
+WRITER_BATCH_SIZE = 500 # Flush when this many rows are pending.
+WRITER_FLUSH_INTERVAL = 1.0 # Flush at least every X sec. when rows are pending.
+WRITER_QUEUE_SIZE = 10000 # Max rows waiting to be written, rows are dropped when full.
+class TelemetryWriter(QThread):
+    """
+    Write-behind stage for telemetry, rows are queued by the UDP thread and inserted in bulk on this thread.
+    Uses COPY on PostgreSQL and a multi-row insert on MySQL.
+    """
+    def __init__(self):
+        super().__init__()
+        settings.settings.SETTINGSEVENT.addListener(self, self.onSettingsChanged)
+        self.shouldDestroy = False
+        self.loadSettings(settings.settings.SETTINGS)
+        self.rows = queue.Queue(self.queueSize)
+        self.rowsWritten = 0
+        self.rowsDropped = 0
+        self.flushes = 0
+        self.lastFlushTime = 0.0
+        self.maxFlushTime = 0.0
+        self.totalFlushTime = 0.0
+
+    def __del__(self):
+        self.destroy()
+
+    def onSettingsChanged(self, name, params):
+        self.loadSettings(params)
+
+    def loadSettings(self, config):
+        self.batchSize = int(config.get("database", "writerBatchSize", fallback=WRITER_BATCH_SIZE))
+        self.flushInterval = float(config.get("database", "writerFlushInterval", fallback=WRITER_FLUSH_INTERVAL))
+        self.queueSize = int(config.get("database", "writerQueueSize", fallback=WRITER_QUEUE_SIZE)) # Only applied on (re)start.
+
+    def destroy(self):
+        self.shouldDestroy = True
+        self.wait()
+
+    def put(self, msg, s, t, time):
+        try:
+            self.rows.put_nowait({"message": str(msg), "severity": s, "type": t, "time": time})
+            return True
+        except queue.Full:
+            self.rowsDropped += 1
+            return False
+
+    def getStatistics(self):
+        """
+        Returns queue depth, flush latency (sec.) and row counters.
+        """
+        return {
+            "depth": self.rows.qsize(),
+            "written": self.rowsWritten,
+            "dropped": self.rowsDropped,
+            "flushes": self.flushes,
+            "lastFlush": self.lastFlushTime,
+            "maxFlush": self.maxFlushTime,
+            "averageFlush": (self.totalFlushTime / self.flushes) if self.flushes > 0 else 0.0
+        }
+
+    def flush(self, batch):
+        """
+        Insert the batch in one go, the batch is dropped if the DB is unavailable.
+        """
+        start = time.perf_counter()
+        conn = None
+        try:
+            target = engine # The engine may be swapped meanwhile, stick to the one we check out from.
+            if USEMYSQL:
+                conn = target.connect()
+                POOL_STATISTICS.addCheckout(time.perf_counter() - start)
+                conn.execute(Event.__table__.insert(), batch)
+            else:
+                buf = io.StringIO()
+                w = csv.writer(buf)
+                for row in batch:
+                    w.writerow((row["message"], row["severity"], row["type"], row["time"]))
+                buf.seek(0)
+                checkout = time.perf_counter()
+                conn = target.raw_connection()
+                POOL_STATISTICS.addCheckout(time.perf_counter() - checkout)
+                cur = conn.cursor()
+                cur.copy_expert("COPY event (message, severity, type, time) FROM STDIN WITH (FORMAT csv)", buf)
+                cur.close()
+                conn.commit()
+            self.rowsWritten += len(batch)
+            SIGNAL.dispatch(True)
+        except Exception as e:
+            print(e)
+            self.rowsDropped += len(batch)
+            SIGNAL.dispatch(False, e)
+        finally:
+            if conn:
+                conn.close()
+
+        elapsed = (time.perf_counter() - start)
+        self.flushes += 1
+        self.lastFlushTime = elapsed
+        self.maxFlushTime = max(self.maxFlushTime, elapsed)
+        self.totalFlushTime += elapsed
+
+    def run(self):
+        batch = list()
+        lastFlush = time.time()
+        while True:
+            # Only wait until the pending batch is due.
+            timeout = max((self.flushInterval - (time.time() - lastFlush)), 0.01) if batch else self.flushInterval
+            try:
+                batch.append(self.rows.get(timeout=timeout))
+                # Grab everything else that is already waiting, without blocking.
+                while len(batch) < self.batchSize:
+                    batch.append(self.rows.get_nowait())
+            except queue.Empty:
+                pass
+
+            now = time.time()
+            if batch and ((len(batch) >= self.batchSize) or ((now - lastFlush) >= self.flushInterval) or self.shouldDestroy):
+                self.flush(batch)
+                batch = list()
+                lastFlush = now
+
+            if self.shouldDestroy and not batch and self.rows.empty():
+                break
 
 #
 # Definitions for the UDP con multicast json msgs.
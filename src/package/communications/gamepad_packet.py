@@ -0,0 +1,85 @@
+""" Encoding + decoding of the gamepad state msgs. sent to the rover, either as full keyframes or as deltas """
+
+import json
+
+# Keyframe: {"Axis": {...}, "Buttons": {...}}, the full state.
+# Delta: {"Delta": {"Axis": {...}, "Buttons": {...}}}, only what changed since the previous msg.
+# Both carry "Seq" + "T" (station monotonic time of the input in sec.) only when they carry a new input,
+# the rover echoes these back as an ack: {"Ack": seq, "T": t}. Periodic resends are not stamped, so every ack is an input's.
+
+def stamp(msg, seq, t):
+    if seq is not None:
+        msg["Seq"] = seq
+        msg["T"] = t
+    return msg
+
+def encodeKeyframe(axis, buttons, seq=None, t=None):
+    return json.dumps(stamp({"Axis": axis, "Buttons": buttons}, seq, t), separators=(',', ':'))
+
+def encodeAck(msg):
+    """
+    Returns the ack for a received msg., None if the msg. was not stamped.
+    """
+    if "Seq" not in msg:
+        return None
+    return json.dumps({"Ack": msg["Seq"], "T": msg["T"]}, separators=(',', ':'))
+
+def carryInputTime(older, newer):
+    """
+    A msg. superseding one which was never sent takes over its input time if that is earlier,
+    so the ack measures from the oldest input still waiting to be sent.
+    An unstamped msg. takes over the stamp, the input it carries is still new to the rover.
+    """
+    try:
+        old, new = json.loads(older), json.loads(newer)
+    except ValueError:
+        return newer
+
+    if ("T" not in old) or (("T" in new) and (old["T"] >= new["T"])):
+        return newer
+    new["Seq"] = new.get("Seq", old["Seq"])
+    new["T"] = old["T"]
+    return json.dumps(new, separators=(',', ':'))
+
+def encodeDelta(axis, buttons, lastAxis, lastButtons, seq=None, t=None):
+    """
+    Returns a delta msg. with the axes + buttons which differ from the last sent state, None if nothing changed.
+    """
+    changedAxis = {k: v for k, v in axis.items() if lastAxis.get(k) != v}
+    changedButtons = {k: v for k, v in buttons.items() if lastButtons.get(k) != v}
+    if not changedAxis and not changedButtons:
+        return None
+
+    delta = dict()
+    if changedAxis:
+        delta["Axis"] = changedAxis
+    if changedButtons:
+        delta["Buttons"] = changedButtons
+    return json.dumps(stamp({"Delta": delta}, seq, t), separators=(',', ':'))
+
+class GamepadState():
+    """
+    Rebuilds the gamepad state on the receiving end from keyframes + deltas.
+    """
+    def __init__(self):
+        self.axis = dict()
+        self.buttons = dict()
+        self.synced = False # Deltas are only meaningful after the first keyframe.
+
+    def apply(self, msg):
+        """
+        Apply a decoded msg., returns false if it was not a gamepad msg.
+        """
+        if "Delta" in msg:
+            delta = msg["Delta"]
+            self.axis.update({int(k): v for k, v in delta.get("Axis", {}).items()})
+            self.buttons.update({int(k): v for k, v in delta.get("Buttons", {}).items()})
+            return True
+
+        if "Axis" in msg or "Buttons" in msg:
+            self.axis = {int(k): v for k, v in msg.get("Axis", {}).items()}
+            self.buttons = {int(k): v for k, v in msg.get("Buttons", {}).items()}
+            self.synced = True
+            return True
+
+        return False
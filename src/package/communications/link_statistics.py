@@ -0,0 +1,81 @@
+""" Rolling link health statistics for the rover telemetry, based on the sequence number + send time of each packet """
+
+from collections import deque
+
+from communications.packet import PACKET_SEQUENCE_MAX
+
+LINK_STATISTICS_WINDOW = 5.0 # Rolling window in sec.
+LINK_JITTER_GAIN = (1 / 16) # Jitter estimator gain, as in RFC 3550.
+LINK_RESET_GAP = 1000 # Sequence jumps larger than this are treated as a rover (re)start.
+
+def sequenceDifference(seq, reference):
+    """
+    Signed distance between two sequence numbers, handles the 32 bit wrap around.
+    """
+    diff = (seq - reference) & PACKET_SEQUENCE_MAX
+    return diff - (PACKET_SEQUENCE_MAX + 1) if diff > (PACKET_SEQUENCE_MAX >> 1) else diff
+
+class LinkStatistics():
+    """
+    Keeps track of packet loss, reordering, inter-arrival jitter and one-way latency over a rolling time window.
+    The latency is only an estimate, it assumes the rover and control station clocks are in sync (NTP).
+    """
+    def __init__(self, window=LINK_STATISTICS_WINDOW):
+        self.window = window
+        self.reset()
+
+    def reset(self):
+        self.highest = None # Highest sequence number received.
+        self.extendedHighest = 0 # Same, but never wraps around.
+        self.lastTransit = None
+        self.jitter = 0.0
+        self.samples = deque() # (receive time, extended seq., reordered, transit time)
+
+    def add(self, seq, sent, received):
+        """
+        Register a packet, sent and received are both unix timestamps in sec.
+        """
+        if self.highest is None:
+            self.highest = seq
+
+        diff = sequenceDifference(seq, self.highest)
+        if abs(diff) > LINK_RESET_GAP:
+            self.reset()
+            self.highest = seq
+            diff = 0
+
+        if diff > 0:
+            self.highest = seq
+            self.extendedHighest += diff
+
+        transit = (received - sent)
+        if self.lastTransit is not None:
+            self.jitter += (abs(transit - self.lastTransit) - self.jitter) * LINK_JITTER_GAIN
+        self.lastTransit = transit
+
+        self.samples.append((received, self.extendedHighest + min(diff, 0), (diff < 0), transit))
+        self.expire(received)
+
+    def expire(self, now):
+        while self.samples and ((now - self.samples[0][0]) > self.window):
+            self.samples.popleft()
+
+    def get(self, now):
+        """
+        Returns loss %, reordering %, jitter (msec) and estimated latency (msec) for the current window.
+        """
+        self.expire(now)
+        count = len(self.samples)
+        if count <= 0:
+            return {"packets": 0, "loss": 0.0, "reordered": 0.0, "jitter": self.jitter * 1000, "latency": 0.0}
+
+        sequences = [s[1] for s in self.samples]
+        expected = (max(sequences) - min(sequences) + 1)
+        received = len(set(sequences))
+        return {
+            "packets": count,
+            "loss": max(0.0, (1 - (received / expected)) * 100),
+            "reordered": (sum(1 for s in self.samples if s[2]) / count) * 100,
+            "jitter": self.jitter * 1000,
+            "latency": (sum(s[3] for s in self.samples) / count) * 1000
+        }
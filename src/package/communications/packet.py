@@ -0,0 +1,127 @@
+""" Encoding + decoding of the telemetry packets published by the rover, either as json or as a fixed binary layout """
+
+import json
+import time
+import struct
+
+PACKET_FORMAT_JSON = "json"
+PACKET_FORMAT_BINARY = "binary"
+PACKET_FORMATS = (PACKET_FORMAT_JSON, PACKET_FORMAT_BINARY)
+
+# Every binary packet starts with a header, magic + schema id, the schema id determines the layout of the body.
+PACKET_MAGIC = b"MC"
+PACKET_HEADER = struct.Struct("<2sB")
+
+# Schema 1: drive, temperature, compass, battery, rotation + severity.
+PACKET_SCHEMA_V1 = 1
+PACKET_BODY_V1 = struct.Struct("<fffffffffB")
+
+# Schema 2: schema 1 prefixed by a sequence number + send time (unix time, sec.)
+PACKET_SCHEMA_V2 = 2
+PACKET_SEQUENCE_V2 = struct.Struct("<Id")
+
+PACKET_SCHEMAS = {
+    PACKET_SCHEMA_V1: PACKET_BODY_V1,
+    PACKET_SCHEMA_V2: PACKET_BODY_V1
+}
+PACKET_SCHEMA_LATEST = PACKET_SCHEMA_V2
+PACKET_SEQUENCE_MAX = 0xFFFFFFFF # Sequence numbers wrap around at 32 bits.
+
+def stamp(obj, seq):
+    """
+    Stamp a telemetry dict with a sequence number + the current send time.
+    """
+    obj["seq"] = (seq & PACKET_SEQUENCE_MAX)
+    obj["sent"] = time.time()
+    return obj
+
+def isBinary(data):
+    """
+    Returns true if the packet uses the binary layout, json packets always start with '{'.
+    """
+    return bytes(data[:len(PACKET_MAGIC)]) == PACKET_MAGIC
+
+def encodeBinary(obj, schema=PACKET_SCHEMA_LATEST):
+    """
+    Pack a telemetry dict into the binary layout, missing fields are sent as zero.
+    """
+    if schema not in PACKET_SCHEMAS:
+        raise ValueError("Unknown telemetry schema id {}!".format(schema))
+
+    drive = obj.get("drive", {})
+    battery = obj.get("battery", {})
+    rotation = obj.get("rotation", {})
+    header = PACKET_HEADER.pack(PACKET_MAGIC, schema)
+    if schema >= PACKET_SCHEMA_V2:
+        header += PACKET_SEQUENCE_V2.pack(obj.get("seq", 0), obj.get("sent", 0))
+
+    return header + PACKET_SCHEMAS[schema].pack(
+        drive.get("speed", 0),
+        drive.get("turn", 0),
+        obj.get("temperature", 0),
+        obj.get("compass", 0),
+        battery.get("voltage", 0),
+        battery.get("capacity", 0),
+        rotation.get("roll", 0),
+        rotation.get("pitch", 0),
+        rotation.get("yaw", 0),
+        obj.get("severity", 0)
+    )
+
+def decodeBinary(data):
+    """
+    Unpack a binary packet into the same dict layout as the json packets.
+    """
+    data = bytes(data)
+    magic, schema = PACKET_HEADER.unpack_from(data)
+    if magic != PACKET_MAGIC or schema not in PACKET_SCHEMAS:
+        raise ValueError("Unknown telemetry packet, schema id {}!".format(schema))
+
+    offset = PACKET_HEADER.size
+    seq, sent = None, None
+    if schema >= PACKET_SCHEMA_V2:
+        seq, sent = PACKET_SEQUENCE_V2.unpack_from(data, offset)
+        offset += PACKET_SEQUENCE_V2.size
+
+    speed, turn, temperature, compass, voltage, capacity, roll, pitch, yaw, severity = PACKET_SCHEMAS[schema].unpack_from(data, offset)
+    obj = {
+        "drive": {"speed": speed, "turn": turn},
+        "temperature": temperature,
+        "compass": compass,
+        "battery": {"voltage": voltage, "capacity": capacity},
+        "rotation": {"roll": roll, "pitch": pitch, "yaw": yaw},
+        "severity": severity
+    }
+    if seq is not None:
+        obj["seq"] = seq
+        obj["sent"] = sent
+    return obj
+
+def encode(obj, fmt=PACKET_FORMAT_JSON):
+    """
+    Encode a telemetry dict using the desired format.
+    """
+    if fmt == PACKET_FORMAT_BINARY:
+        return encodeBinary(obj)
+    return json.dumps(obj).encode()
+
+def isNumber(v, integer=False):
+    return isinstance(v, int if integer else (int, float)) and not isinstance(v, bool)
+
+def validate(obj):
+    """
+    Raises ValueError if a decoded packet is not a dict, or has a sequence number without a numeric send time.
+    """
+    if not isinstance(obj, dict):
+        raise ValueError("Telemetry packet is not an object!")
+    if ("seq" in obj) and not (isNumber(obj["seq"], True) and isNumber(obj.get("sent"))):
+        raise ValueError("Telemetry packet with an invalid seq/sent!")
+    return obj
+
+def decode(data):
+    """
+    Decode a telemetry packet, the format is detected from the packet itself.
+    """
+    if isBinary(data):
+        return decodeBinary(data)
+    return validate(json.loads(bytes(data)))
@@ -1,15 +1,26 @@
 """ 
 Initializes the rover UDP server. (currently acting as a dummy)
 TODO: Implement ROS, listen to the 'right' nodes, bundle up a dictionary containing relevant data, send it to the multicast address. (test on the rover)
+
+Doubles as a load generator for the control station, e.g. 500 packets/s in bursts of 10 for one minute:
+python package/communications/rover_server.py --rate 500 --burst 10 --duration 60 (from the src folder)
 """
 
+import os
+import sys
 import time
 import json
 import random
 import signal
+import argparse
 
 from PyQt5.QtNetwork import QUdpSocket, QHostAddress, QNetworkInterface
 
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from communications import packet, gamepad_packet
+from utils.math import clamp, maxVal
+
 GAMEPAD_SERVER_ADDRESS = QHostAddress("127.0.0.1")
 GAMEPAD_SERVER_PORT = 5000
 
@@ -17,10 +28,13 @@ SENSOR_PUBLISH_SERVER = QHostAddress("239.255.43.21")
 SENSOR_PUBLISH_PORT = 45454
 
 RUNNING = True
+REPORT_INTERVAL = 1 # How often in sec. the achieved send rate is printed.
+GAMEPAD_POLL_INTERVAL = (10 / 1000) # Max time in sec. between checks for incoming gamepad msgs.
 
-def generate_random_data():
+def generate_random_data(fields=0):
     """
-    Generates random sensor data, returns as a json object.
+    Generates random sensor data, returns as a dict, use packet.encode to serialize it.
+    Extra fields are only sent with the json format.
     """
     output = {}
 
@@ -55,7 +69,49 @@ def generate_random_data():
     # Message severity MAX 3 types
     output["severity"] = random.randint(0,3) # Common for all msgs.
 
-    return json.dumps(output).encode()
+    for i in range(fields):
+        output["field{}".format(i)] = random.randint(0, 1000)
+
+    return output
+
+def pad_packet(data, obj, size, fmt):
+    """
+    Pad an encoded packet up to roughly size bytes, json packets get a padding field, binary packets trailing zeroes.
+    """
+    missing = size - len(data)
+    if missing <= 0:
+        return data
+
+    if fmt == packet.PACKET_FORMAT_BINARY:
+        return data + bytes(missing)
+
+    obj["padding"] = "x" * maxVal(missing - len(', "padding": ""'), 0)
+    return packet.encode(obj, fmt)
+
+def read_gamepad_messages(server, state):
+    """
+    Read every message received from the control station, gamepad keyframes + deltas are applied to the state.
+    Returns the amount of gamepad msgs. applied, the state itself is printed with the periodic report.
+    """
+    count = 0
+    while server.hasPendingDatagrams():
+        data, inAddress, inPort = server.readDatagram(server.pendingDatagramSize())
+        try:
+            msg = json.loads(data.decode())
+        except Exception as e:
+            print("Invalid msg. :", e)
+            continue
+
+        # Echo an ack, so the control station can measure the input to rover round-trip time.
+        ack = gamepad_packet.encodeAck(msg)
+        if ack:
+            server.writeDatagram(ack.encode(), inAddress, inPort)
+
+        if state.apply(msg):
+            count += 1
+        else:
+            print("IN :", msg)
+    return count
 
 def startGamepadListener():
     s = QUdpSocket()
@@ -72,6 +128,19 @@ def shutdown(sig, frame):
     RUNNING = False
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Dummy rover server, publishes random sensor data.")
+    parser.add_argument("--format", choices=packet.PACKET_FORMATS, default=packet.PACKET_FORMAT_JSON, help="Telemetry wire format.")
+    parser.add_argument("--rate", type=float, default=2, help="Average packets per sec.")
+    parser.add_argument("--burst", type=int, default=1, help="Packets sent back-to-back per burst, bursts are spaced to keep the average rate.")
+    parser.add_argument("--fields", type=int, default=0, help="Extra random fields per packet (json only).")
+    parser.add_argument("--payload", type=int, default=0, help="Minimum packet size in bytes, packets are padded up to this size.")
+    parser.add_argument("--duration", type=float, default=0, help="Run time in sec., 0 runs until interrupted.")
+    args = parser.parse_args()
+    if args.rate <= 0:
+        parser.error("--rate must be greater than 0")
+    burst = maxVal(args.burst, 1)
+    burstInterval = burst / args.rate
+
     # Receive gamepad changes from client (control station)
     gamepadServer = startGamepadListener()
     # Start a multicast publisher which writes to the given mcast addr. so that we can read a 'stream' of sensor changes, multiple clients can read from this stream too!
@@ -79,14 +148,45 @@ if __name__ == "__main__":
 
     signal.signal(signal.SIGINT, shutdown)
 
+    gamepadState = gamepad_packet.GamepadState()
+
     print("Starting server...")
+    seq = 0
+    sentBytes = 0
+    start = time.perf_counter()
+    nextBurst = start
+    lastReport, lastReportSeq = start, 0
+    gamepadMessages = 0 # Gamepad msgs. received since the last report.
     while RUNNING:
-        if gamepadServer.hasPendingDatagrams():
-            data, inAddress, inPort = gamepadServer.readDatagram(gamepadServer.pendingDatagramSize())
-            print("IN :", data.decode())
-
-        sensorPublisher.writeDatagram(generate_random_data(), SENSOR_PUBLISH_SERVER, SENSOR_PUBLISH_PORT)
-        time.sleep(500 / 1000)
+        now = time.perf_counter()
+        if args.duration > 0 and (now - start) >= args.duration:
+            break
+
+        gamepadMessages += read_gamepad_messages(gamepadServer, gamepadState)
+
+        if now >= nextBurst:
+            for _ in range(burst):
+                obj = packet.stamp(generate_random_data(args.fields), seq)
+                data = pad_packet(packet.encode(obj, args.format), obj, args.payload, args.format)
+                sensorPublisher.writeDatagram(data, SENSOR_PUBLISH_SERVER, SENSOR_PUBLISH_PORT)
+                sentBytes += len(data)
+                seq += 1
+            nextBurst += burstInterval
+
+        if (now - lastReport) >= REPORT_INTERVAL:
+            print("Sent {:.1f} packets/s (target {:.1f})".format((seq - lastReportSeq) / (now - lastReport), args.rate))
+            if gamepadMessages > 0:
+                if gamepadState.synced:
+                    print("GAMEPAD : {} msgs.,".format(gamepadMessages), gamepadState.axis, gamepadState.buttons)
+                else:
+                    print("GAMEPAD : {} msgs., waiting for keyframe".format(gamepadMessages))
+                gamepadMessages = 0
+            lastReport, lastReportSeq = now, seq
+
+        time.sleep(clamp(nextBurst - time.perf_counter(), 0, GAMEPAD_POLL_INTERVAL))
+
+    elapsed = time.perf_counter() - start
+    print("Sent {} packets, {} bytes in {:.1f} sec., {:.1f} packets/s, {:.3f} Mbit/s".format(seq, sentBytes, elapsed, seq / elapsed, (sentBytes * 8) / (elapsed * 1000000)))
 
     # Cleanup
     gamepadServer.close()
@@ -1,35 +1,103 @@
 """ Establishes a UDP connection with the Rover, implements methods for sending & receiving data! """
 
 import time
-import queue
 import json
+import queue
 import datetime
 
 from PyQt5.QtCore import QThread, pyqtSignal
 from PyQt5.QtNetwork import QUdpSocket, QHostAddress, QNetworkInterface
 
 from utils import event
+from utils.math import clamp, maxVal, minVal
 from settings import settings as cfg
-from communications import database
+from communications import database, packet, capture, gamepad_packet
+from communications.link_statistics import LinkStatistics
+from communications.command_latency import LatencyHistogram
 
 # 192.168.1.3 <- actual server addr. to use.
 
 ROVERSERVER = None # Allow other files/pgks to easily access our udp server through this global.
-TICK = (50 / 1000) # How often in msec should we check inc / send outgoing msgs.
+TICK = (10 / 1000) # Max time in sec. to wait for incoming packets before checking outgoing msgs.
 TIMEOUT = 5 # How many seconds the control station will wait for a message before sending an error
+LINK_STATISTICS_INTERVAL = 1 # How often in sec. the link statistics are sent to the UI.
+DISPLAY_RATE = 30 # How many times per sec. the UI is updated with the latest telemetry at most.
+REPLAY_BATCH = 1000 # Max packets replayed per loop, keeps outgoing msgs. flowing during fast replays.
+
+COMMAND_KEY_GAMEPAD = "gamepad" # Gamepad state msgs. supersede each other, only the newest queued one is sent.
+COMMAND_COALESCE = {COMMAND_KEY_GAMEPAD: gamepad_packet.carryInputTime} # (superseded msg., newest msg.) -> msg. to send, per key.
+
+# Outbound lanes, lower lanes are always sent first.
+COMMAND_PRIORITY_CRITICAL = 0 # Operator commands, motion mode, custom msgs., etc...
+COMMAND_PRIORITY_STREAM = 1 # Continuous state, e.g. the gamepad.
+COMMAND_PRIORITY_NAMES = ("critical", "stream")
+
+class LaneStatistics():
+    """
+    Queue depth + time spent in the queue for one outbound lane.
+    """
+    def __init__(self):
+        self.sent = 0
+        self.superseded = 0 # Queued msgs. dropped since a newer msg. with the same key was queued.
+        self.lastDepth = 0 # Msgs. waiting when the lane was last drained.
+        self.maxDepth = 0
+        self.lastAge = 0.0 # Time in sec. the last msg. waited in the queue before being sent.
+        self.maxAge = 0.0
+        self.totalAge = 0.0
+
+    def addDrained(self, queued, kept):
+        self.lastDepth = queued
+        self.maxDepth = maxVal(self.maxDepth, queued)
+        self.superseded += (queued - kept)
+
+    def addSent(self, age):
+        self.sent += 1
+        self.lastAge = age
+        self.maxAge = maxVal(self.maxAge, age)
+        self.totalAge += age
+
+    def get(self):
+        return {
+            "sent": self.sent,
+            "superseded": self.superseded,
+            "lastDepth": self.lastDepth,
+            "maxDepth": self.maxDepth,
+            "lastAge": self.lastAge,
+            "maxAge": self.maxAge,
+            "averageAge": (self.totalAge / self.sent) if self.sent > 0 else 0.0
+        }
 
 class UDPRoverServer(QThread):
     onReceiveData = pyqtSignal('PyQt_PyObject')
     communicationTimeout = pyqtSignal(bool)
+    linkStatistics = pyqtSignal(dict)
+    commandLatency = pyqtSignal(dict)
 
     def __init__(self):
         super().__init__()
         cfg.SETTINGSEVENT.addListener(self, self.onSettingsChanged)
         self.shouldDestroy = False
-        self.messagesToSend = queue.Queue()    
+        self.messagesToSend = [queue.Queue() for _ in COMMAND_PRIORITY_NAMES] # One queue per lane, (coalesce key, time queued, msg)
+        self.laneStatistics = [LaneStatistics() for _ in COMMAND_PRIORITY_NAMES]
+        self.commandLatencyHistogram = LatencyHistogram() # Input to rover ack round-trip time, in msec.
+        self.resetCommandLatency = False
         self.gamepadSocket = None
         self.sensorpubSocket = None
         self.lastSensorBroadcastAddress = None
+        self.packetsReceived = 0 # Total packets read from the sensor publisher.
+        self.wakeups = 0 # How many times the socket woke us up with at least one packet.
+        self.lastReadCount = 0 # Packets read during the last wakeup.
+        self.maxReadCount = 0 # Most packets read during a single wakeup.
+        self.malformedPackets = 0 # Packets which could not be decoded.
+        self.link = LinkStatistics()
+        self.lastLinkStatistics = self.link.get(time.time())
+        self.pendingData = dict() # Latest value per key, not yet sent to the UI.
+        self.nextDisplayTime = 0.0
+        self.mergedUpdates = 0 # Packets merged into a pending UI update instead of being sent on their own.
+        self.capture = None
+        self.replay = None
+        self.captureRequest = None # Path to capture to, empty to stop, handled on the UDP thread.
+        self.replayRequest = None # (path, speed), empty path to stop, handled on the UDP thread.
         self.loadSettings(cfg.SETTINGS)
     
     def __del__(self):
@@ -57,14 +125,223 @@ class UDPRoverServer(QThread):
         self.gamepadSocket = None
         self.sensorpubSocket = None
 
-    def writeToRover(self, data):
-        self.messagesToSend.put_nowait(data)
+    def writeToRover(self, data, key=None, priority=COMMAND_PRIORITY_CRITICAL):
+        """
+        Queue a msg. for the rover in the desired lane, critical msgs. are never stuck behind stream msgs.
+        Msgs. with a key are superseded by newer msgs. with the same key which are queued before it is sent.
+        """
+        self.messagesToSend[priority].put_nowait((key, time.time(), data))
 
-    def fetchMessageToSend(self):
+    def fetchMessagesToSend(self, priority):
+        """
+        Drain one lane, returns the msgs. to send in order as (time queued, msg), superseded msgs. are left out.
+        """
+        queued = list()
         try:
-             return self.messagesToSend.get_nowait()
-        except: # Raises an exception if empty.
-            return ''
+            while True:
+                queued.append(self.messagesToSend[priority].get_nowait())
+        except queue.Empty:
+            pass
+
+        if not queued:
+            return queued
+
+        # Keep only the newest msg. per key, at the position of the newest one.
+        newest = dict()
+        for idx, (key, _, _) in enumerate(queued):
+            if key is not None:
+                newest[key] = idx
+
+        output = list()
+        superseded = dict() # Oldest superseded msg. per key.
+        for idx, (key, t, d) in enumerate(queued):
+            if key is None:
+                output.append((t, d))
+            elif newest[key] != idx:
+                superseded.setdefault(key, d)
+            else:
+                if (key in superseded) and (key in COMMAND_COALESCE):
+                    d = COMMAND_COALESCE[key](superseded[key], d)
+                output.append((t, d))
+        self.laneStatistics[priority].addDrained(len(queued), len(output))
+        return output
+
+    def sendMessagesToRover(self):
+        """
+        Send everything that is due this cycle, lane by lane, critical first.
+        """
+        for priority, stats in enumerate(self.laneStatistics):
+            for queuedTime, d in self.fetchMessagesToSend(priority):
+                self.gamepadSocket.writeDatagram(d.encode(), self.serverAddress, self.serverPort)
+                stats.addSent(time.time() - queuedTime)
+
+    def readGamepadAcks(self):
+        """
+        Read the acks echoed by the rover's gamepad server, add the input to ack round-trip time to the histogram.
+        """
+        while self.gamepadSocket.hasPendingDatagrams():
+            data, _, _ = self.gamepadSocket.readDatagram(self.gamepadSocket.pendingDatagramSize())
+            try:
+                msg = json.loads(data)
+                if "Ack" in msg:
+                    self.commandLatencyHistogram.add((time.monotonic() - float(msg["T"])) * 1000)
+            except Exception as e:
+                print(e)
+
+    def clearCommandLatency(self):
+        self.resetCommandLatency = True
+
+    def getOutboundStatistics(self):
+        """
+        Returns queue depth and command age (sec.) at send time, per lane name.
+        """
+        output = dict()
+        for priority, name in enumerate(COMMAND_PRIORITY_NAMES):
+            output[name] = self.laneStatistics[priority].get()
+            output[name]["depth"] = self.messagesToSend[priority].qsize()
+        return output
+
+    def startCapture(self, path):
+        """
+        Append every raw datagram received from the rover to a capture file.
+        """
+        self.captureRequest = path
+
+    def stopCapture(self):
+        self.captureRequest = ""
+
+    def startReplay(self, path, speed=1.0):
+        """
+        Replay a capture file in place of the live socket, speed 0 replays as fast as possible.
+        """
+        self.replayRequest = (path, speed)
+
+    def stopReplay(self):
+        self.replayRequest = ("", 0)
+
+    def handleCaptureRequests(self):
+        if self.captureRequest is not None:
+            path = self.captureRequest
+            self.captureRequest = None
+            if self.capture:
+                self.capture.close()
+                self.capture = None
+            if path:
+                try:
+                    self.capture = capture.CaptureWriter(path)
+                except Exception as e:
+                    print(e)
+
+        if self.replayRequest is not None:
+            path, speed = self.replayRequest
+            self.replayRequest = None
+            self.replay = None
+            if path:
+                try:
+                    self.replay = capture.CaptureReplay(path, speed)
+                except Exception as e:
+                    print(e)
+
+    def readSensorDatagrams(self):
+        """
+        Read all pending datagrams from the sensor publisher, returns the amount of packets read during this wakeup.
+        """
+        count = 0
+        while self.sensorpubSocket.hasPendingDatagrams():
+            data, _, _ = self.sensorpubSocket.readDatagram(self.sensorpubSocket.pendingDatagramSize())
+            if data:
+                received = time.time()
+                if self.capture:
+                    self.capture.write(data, received)
+                self.processSensorData(data, received)
+                count += 1
+
+        self.addReadCount(count)
+        return count
+
+    def discardSensorDatagrams(self):
+        """
+        Drop the live datagrams received while a capture is replayed, otherwise they pile up in the kernel buffer
+        and arrive as a stale burst once the replay ends.
+        """
+        while self.sensorpubSocket.hasPendingDatagrams():
+            self.sensorpubSocket.readDatagram(self.sensorpubSocket.pendingDatagramSize())
+
+    def readReplayDatagrams(self, now):
+        """
+        Process the packets which are due from the capture being replayed, returns the amount of packets processed.
+        """
+        records = self.replay.poll(now, REPLAY_BATCH)
+        for received, data in records:
+            self.processSensorData(data, received)
+
+        count = len(records)
+        self.addReadCount(count)
+        if self.replay.finished():
+            print("Finished replaying {} packets.".format(self.replay.replayed))
+            self.replay = None
+        return count
+
+    def addReadCount(self, count):
+        if count > 0:
+            self.wakeups += 1
+            self.packetsReceived += count
+            self.lastReadCount = count
+            self.maxReadCount = maxVal(self.maxReadCount, count)
+
+    def processSensorData(self, data, received):
+        """
+        Decode one packet from the rover, notify the UI, measurements may be stored in the database.
+        A bad packet is counted as malformed + dropped, it never ends the UDP thread.
+        """
+        try:
+            obj = packet.decode(data)
+            severity = int(obj.get("severity", "0"))
+        except Exception as e:
+            self.malformedPackets += 1
+            print(e)
+            return
+
+        try:
+            if "seq" in obj:
+                self.link.add(obj["seq"], obj["sent"], received)
+
+            # The UI only needs the latest value per key, the DB still gets every sample.
+            if self.pendingData:
+                self.mergedUpdates += 1
+            self.pendingData.update(obj)
+
+            for k, v in obj.items():
+                if k and database.shouldStoreData(k):
+                    database.addTelemetry(database.getValueForData(k, v), severity, database.getTypeForData(k), str(datetime.datetime.now()))
+        except Exception as e:
+            self.malformedPackets += 1
+            print(e)
+
+    def dispatchPendingData(self, now):
+        """
+        Send the merged telemetry to the UI, at most DISPLAY_RATE times per sec.
+        """
+        if not self.pendingData or (now < self.nextDisplayTime):
+            return
+
+        self.onReceiveData.emit(self.pendingData)
+        self.pendingData = dict()
+        self.nextDisplayTime = now + (1 / self.displayRate)
+
+    def getIngestStatistics(self):
+        """
+        Returns the amount of packets read per wakeup (last, max and average), along with the total packets received.
+        """
+        return {
+            "packets": self.packetsReceived,
+            "wakeups": self.wakeups,
+            "last": self.lastReadCount,
+            "max": self.maxReadCount,
+            "malformed": self.malformedPackets,
+            "merged": self.mergedUpdates,
+            "average": (self.packetsReceived / self.wakeups) if self.wakeups > 0 else 0.0
+        }
 
     def onSettingsChanged(self, name, params):
         self.loadSettings(params)
@@ -76,6 +353,7 @@ class UDPRoverServer(QThread):
         self.clientPort = int(config.get("communication", "clientGamepadPort"))     
         self.sensorBroadcastAddress = QHostAddress(config.get("communication", "serverRoverAddress"))
         self.sensorBroadcastPort = int(config.get("communication", "serverRoverPort"))    
+        self.displayRate = maxVal(float(config.get("communication", "displayRate", fallback=DISPLAY_RATE)), 1)
         self.reconnect = True 
 
     def destroy(self):
@@ -84,6 +362,7 @@ class UDPRoverServer(QThread):
 
     def run(self):
         lastMessageTime = time.time()
+        lastLinkStatistics = lastMessageTime
         while self.shouldDestroy == False:
             now = time.time()
             if self.reconnect:
@@ -97,30 +376,25 @@ class UDPRoverServer(QThread):
                 time.sleep(TICK)   
                 continue
 
-            # The rover's gamepad server shouldn't send any packets to the control station, if this changes, uncomment this code and process the incoming packet.
-            # if self.gamepadSocket.hasPendingDatagrams():
-            #     data, _, _ = self.gamepadSocket.readDatagram(self.gamepadSocket.pendingDatagramSize())
-            #     if data:
-            #         lastMessageTime = now
-            #         print(data.decode())
-
-            if self.sensorpubSocket.hasPendingDatagrams():
-                data, _, _ = self.sensorpubSocket.readDatagram(self.sensorpubSocket.pendingDatagramSize())
-                if data:
-                    lastMessageTime = now
-                    obj = json.loads(data)
-                    self.onReceiveData.emit(obj)
-                    # Process incoming packets, measurements may be stored in the database.
-                    severity = int(obj.get("severity", "0"))
-                    for k, v in obj.items():
-                        if k and database.shouldStoreData(k):
-                            database.Event.add(database.getValueForData(k, v), severity, database.getTypeForData(k), str(datetime.datetime.now()))
-
-            # Fetch messages from a thread-safe queue, if empty, skip and wait
-            # for TICK time.
-            d = self.fetchMessageToSend()
-            if d:
-                self.gamepadSocket.writeDatagram(d.encode(), self.serverAddress, self.serverPort)    
+            # The rover's gamepad server only sends acks for our gamepad msgs.
+            if self.resetCommandLatency:
+                self.resetCommandLatency = False
+                self.commandLatencyHistogram.reset()
+            self.readGamepadAcks()
+
+            self.handleCaptureRequests()
+
+            # Drain every datagram queued on the socket, not just one per wakeup, otherwise the kernel buffer fills up at higher rates.
+            # When replaying a capture, the capture replaces the socket.
+            if self.replay:
+                self.discardSensorDatagrams()
+            if (self.readReplayDatagrams(now) if self.replay else self.readSensorDatagrams()) > 0:
+                lastMessageTime = now
+
+            self.dispatchPendingData(time.time())
+
+            # Send every msg. queued since the last cycle, superseded gamepad states are skipped.
+            self.sendMessagesToRover()
 
             # Check for inactivity, if no packet has been received within TIMEOUT sec, send signal to UI that we no longer have comms. with the rover.
             if (now - lastMessageTime) > TIMEOUT:
@@ -129,8 +403,25 @@ class UDPRoverServer(QThread):
             elif now == lastMessageTime:
                 self.communicationTimeout.emit(True)
 
-            time.sleep(TICK)   
+            if (now - lastLinkStatistics) >= LINK_STATISTICS_INTERVAL:
+                self.lastLinkStatistics = self.link.get(self.replay.clock if self.replay else now)
+                self.linkStatistics.emit(self.lastLinkStatistics)
+                self.commandLatency.emit(self.commandLatencyHistogram.get())
+                lastLinkStatistics = now
+
+            # Sleep until the rover publishes something new, or at most TICK sec. so that outgoing msgs. are still sent.
+            # Wake up earlier if there is a UI update due.
+            timeout = TICK
+            if self.pendingData:
+                timeout = clamp(self.nextDisplayTime - time.time(), 0, TICK)
+            if self.replay:
+                time.sleep(minVal(timeout, self.replay.timeUntilNext(time.time())))
+            else:
+                self.sensorpubSocket.waitForReadyRead(int(timeout * 1000))
 
+        if self.capture:
+            self.capture.close()
+            self.capture = None
         self.disconnect()
 
 def connectToRoverServer():
@@ -1,11 +1,16 @@
 """ Reading the input from a game controller """
 
-import json, time
+import time
 
-from pygame import joystick, time as pygameTime, event, init, quit, JOYBUTTONDOWN, JOYAXISMOTION, JOYHATMOTION, JOYBUTTONUP
+import pygame
+from pygame import joystick, event, init, quit, JOYBUTTONDOWN, JOYAXISMOTION, JOYHATMOTION, JOYBUTTONUP
 from PyQt5.QtCore import QThread, pyqtSignal
 
 from communications import udp_conn as UDP
+from communications import gamepad_packet
+from controller import recording
+from controller import profiles
+from settings import settings as cfg
 from utils.math import clamp, maxVal
 
 # A lot of help from
@@ -39,40 +44,31 @@ ROVER_MAPPING_BUTTONS = {
     10 : False
 }
 
-GAMEPAD_REFRESH_INTERVAL_CONNECTED = 10 # Time to wait between refreshes when at least one controller is connected.
-GAMEPAD_REFRESH_INTERVAL_DISCONNECTED = 1 # Time to wait between refreshes when no controller is connected at all.
+GAMEPAD_REFRESH_INTERVAL_DISCONNECTED = 1 # Time to wait between refreshes when no controller is connected at all, only without hotplug events.
+
+# Device add/remove events, pygame 2+ only (SDL2 uses udev on Linux), older versions fall back to refreshing while disconnected.
+JOYDEVICEADDED = getattr(pygame, "JOYDEVICEADDED", None)
+JOYDEVICEREMOVED = getattr(pygame, "JOYDEVICEREMOVED", None)
+GAMEPAD_HOTPLUG = (JOYDEVICEADDED is not None) and (JOYDEVICEREMOVED is not None)
+GAMEPAD_KEYFRAME_INTERVAL = 1.0 # Time between full state msgs. when only sending deltas.
+GAMEPAD_SEND_RATE = 50 # How many times per sec. the controller state is sent to the rover.
+GAMEPAD_POLL_INTERVAL = (4 / 1000) # Max time in sec. between input samples, independent of the send rate.
+GAMEPAD_JITTER_GAIN = (1 / 16) # Smoothing of the send interval jitter estimate.
 
 class Gamepad(QThread):
     """Class for gamepad"""
     statusChanged = pyqtSignal(bool)
     refreshedGamepad = pyqtSignal(dict)
+    replayFinished = pyqtSignal()
 
     # Init does not initialize the gamepad
-    def __init__(self, deadzone=0.1):
+    def __init__(self, deadzone=None):
         super().__init__()
         # Initializes pygame and creates a instance of a clock to control the
         # tick rate.
         init()
 
         self.shouldDestroy = False
-        # Gamepad (pygame) mapping for Windows
-        self.gamepad_mapping = {
-            "A" : 0,
-            "B" : 1,
-            "X" : 2,
-            "Y" : 3,
-            "LB" : 4,
-            "RB" : 5,
-            "BACK" : 6,
-            "START" : 7,
-            "LEFT_STICK_BUTTON" : 8,
-            "RIGHT_STICK_BUTTON" : 9,
-            "LEFT_STICK_X" : 0,
-            "LEFT_STICK_Y" : 1,
-            "BUMPERS" : 2,
-            "RIGHT_STICK_Y" : 3,
-            "RIGHT_STICK_X" : 4
-        }
         # Local instance of rover mapping
         self.rover_axis = ROVER_MAPPING_AXIS
         self.rover_buttons = ROVER_MAPPING_BUTTONS
@@ -81,7 +77,37 @@ class Gamepad(QThread):
         self.joystick = None
         self.joystick_id = -1
         self.joystick_id_switch = -1
-        self.deadzone = deadzone
+        self.deadzone = deadzone # Overrides the deadzone of the profile.
+        self.profile = None
+        self.forcedProfile = "" # Profile name from the settings, empty to pick one by controller name.
+        profiles.loadProfiles()
+
+        # Delta protocol, only changed axes + buttons are sent, with a full keyframe every now and then for loss recovery.
+        self.lastSentAxis = dict()
+        self.lastSentButtons = dict()
+        self.lastKeyframeTime = 0.0
+
+        # Latency measurement, every msg. carries a sequence number + the monotonic time of the input sample it reflects.
+        self.sendSeq = 0
+        self.lastInputTime = None # Time of the latest input change which has not been sent yet.
+
+        # Send scheduler statistics, deviation (sec.) of the actual send interval from the configured one.
+        self.lastSendTick = None
+        self.sendJitter = 0.0
+        self.maxSendJitter = 0.0
+        self.sendCount = 0
+
+        # Input session recording + replay, requests are handled on the gamepad thread.
+        self.recorder = None
+        self.replay = None
+        self.recordRequest = None # Path to record to, empty to stop.
+        self.replayRequest = None # (path, speed), empty path to stop.
+
+        # Time (sec.) spent handling device changes, full refreshes + hotplug events.
+        self.lastRefreshLatency = 0.0
+        self.maxRefreshLatency = 0.0
+        cfg.SETTINGSEVENT.addListener(self, self.onSettingsChanged)
+        self.loadSettings(cfg.SETTINGS)
 
     def __del__(self):
         self.destroy()    
@@ -90,6 +116,27 @@ class Gamepad(QThread):
         self.shouldDestroy = True
         self.wait()
 
+    def onSettingsChanged(self, name, params):
+        self.loadSettings(params)
+
+    def loadSettings(self, config):
+        self.useDelta = (config.get("communication", "gamepadDelta", fallback="False") == "True")
+        self.keyframeInterval = float(config.get("communication", "gamepadKeyframeInterval", fallback=GAMEPAD_KEYFRAME_INTERVAL))
+        self.lastKeyframeTime = 0.0 # Start over with a keyframe.
+        self.sendPeriod = 1 / maxVal(float(config.get("communication", "gamepadSendRate", fallback=GAMEPAD_SEND_RATE)), 1)
+        self.lastSendTick = None
+        forced = config.get("communication", "gamepadProfile", fallback="")
+        if (self.profile is None) or (forced != self.forcedProfile):
+            self.forcedProfile = forced
+            self.selectProfile()
+
+    def selectProfile(self):
+        """
+        Compile the mapping profile for the active controller, reads happen through the compiled tables only.
+        """
+        name = profiles.findProfile(self.joystick.get_name() if self.joystick else "", self.forcedProfile)
+        self.profile = profiles.compileProfile(name, self.deadzone)
+
     # Initializes the joystick
     def initialize(self, id):
         """Initializes the selected joystick"""
@@ -100,6 +147,7 @@ class Gamepad(QThread):
             self.joystick_id = id
             self.joystick = joystick.Joystick(id)
             self.joystick.init()
+            self.selectProfile()
         except:
             self.joystick_id = -1
             print("Invalid joystick num/ID,", id, "!")
@@ -134,47 +182,117 @@ class Gamepad(QThread):
         self.refreshedGamepad.emit(joyDictList)
         self.statusChanged.emit(self.joystick.get_init() if self.joystick else False)
 
+    def get_gamepad_names(self):
+        """
+        Same as get_all_gamepads, but leaves every joystick initialized, safe to use while a joystick is active (pygame 2+).
+        """
+        return {i: joystick.Joystick(i).get_name() for i in range(joystick.get_count())}
+
+    def hotplug(self, e):
+        """
+        Handle a single device being added or removed, the active joystick is left alone unless it was the one removed.
+        """
+        if e.type == JOYDEVICEADDED:
+            if self.joystick is None:
+                self.initialize(e.device_index)
+        elif e.type == JOYDEVICEREMOVED:
+            if self.joystick and (self.joystick.get_instance_id() == e.instance_id):
+                self.joystick = None
+                self.joystick_id = -1
+                if joystick.get_count() > 0:
+                    self.initialize(0)
+
+        self.refreshedGamepad.emit(self.get_gamepad_names())
+        self.statusChanged.emit(self.joystick.get_init() if self.joystick else False)
+
+    def recordRefreshLatency(self, start):
+        latency = (time.perf_counter() - start)
+        self.lastRefreshLatency = latency
+        self.maxRefreshLatency = maxVal(self.maxRefreshLatency, latency)
+
+    def getRefreshStatistics(self):
+        """
+        Returns how long (sec.) handling device changes took, last + max.
+        """
+        return {
+            "hotplug": GAMEPAD_HOTPLUG,
+            "last": self.lastRefreshLatency,
+            "max": self.maxRefreshLatency
+        }
+
+    def startRecording(self, path):
+        """
+        Record every raw axis, button and hat event to a file.
+        """
+        self.recordRequest = path
+
+    def stopRecording(self):
+        self.recordRequest = ""
+
+    def startReplay(self, path, speed=1.0):
+        """
+        Replay a recording in place of the physical controller, speed 0 replays one event per send.
+        """
+        self.replayRequest = (path, speed)
+
+    def stopReplay(self):
+        self.replayRequest = ("", 0)
+
+    def handleRecordingRequests(self):
+        if self.recordRequest is not None:
+            path = self.recordRequest
+            self.recordRequest = None
+            if self.recorder:
+                self.recorder.close()
+                self.recorder = None
+            if path:
+                try:
+                    self.recorder = recording.InputRecorder(path, self.joystick.get_name() if self.joystick else "")
+                except Exception as e:
+                    print(e)
+
+        if self.replayRequest is not None:
+            path, speed = self.replayRequest
+            self.replayRequest = None
+            if self.replay:
+                self.finishReplay()
+            if path:
+                try:
+                    self.replay = recording.InputReplay(path, speed)
+                    self.joystick = self.replay.joystick
+                    self.lastKeyframeTime = float("-inf") # Start with a keyframe, also on the replay clock.
+                    self.selectProfile()
+                    self.statusChanged.emit(True)
+                except Exception as e:
+                    print(e)
+
+    def replayClock(self):
+        """
+        Time (sec.) of an as fast as possible replay, one send period per replayed event, keyframes are sent on this clock.
+        """
+        return self.replay.position * self.sendPeriod
+
+    def finishReplay(self):
+        """
+        Replay done, go back to the physical controller.
+        """
+        self.replay = None
+        self.joystick = None
+        self.needRefresh = True
+        self.replayFinished.emit()
+
     def get_joystick_id(self):
         """
         Returns the joysticks id
         """
         return self.joystick_id
 
-    def axis_value(self, value):
-        """
-        Deadzone calculations
-        created by joncoop at github see link at the top
-        """
-        if value > self.deadzone:
-            newValue = (value - self.deadzone) / (1 - self.deadzone)
-            if newValue > 0.95:
-                return 1
-            else:
-                return newValue
-        elif value < -self.deadzone:
-            newValue = (value + self.deadzone) / (1 - self.deadzone)
-            if newValue < -0.95:
-                return -1
-            else:
-                return newValue
-        else:
-            return 0
-
     def read_rover_buttons(self):
         """
         A lot like the get_buttons function, but specialized for the rover and does not return anything
         """
-        self.rover_buttons[0] = bool(self.joystick.get_button(self.gamepad_mapping["A"]))
-        self.rover_buttons[1] = bool(self.joystick.get_button(self.gamepad_mapping["B"]))
-        self.rover_buttons[2] = bool(self.joystick.get_button(self.gamepad_mapping["Y"]))
-        self.rover_buttons[3] = bool(self.joystick.get_button(self.gamepad_mapping["X"]))
-        self.rover_buttons[4] = bool(self.joystick.get_button(self.gamepad_mapping["LB"]))
-        self.rover_buttons[5] = bool(self.joystick.get_button(self.gamepad_mapping["RB"]))
-        self.rover_buttons[6] = bool(self.joystick.get_button(self.gamepad_mapping["START"]))
-        self.rover_buttons[7] = bool(self.joystick.get_button(self.gamepad_mapping["BACK"]))
-        self.rover_buttons[8] = False # XBOX Button
-        self.rover_buttons[9] = bool(self.joystick.get_button(self.gamepad_mapping["LEFT_STICK_BUTTON"]))
-        self.rover_buttons[10] = bool(self.joystick.get_button(self.gamepad_mapping["RIGHT_STICK_BUTTON"]))
+        for i, pressed in enumerate(self.profile.readButtons(self.joystick)):
+            self.rover_buttons[i] = pressed
 
     def read_rover_axis(self):
         """
@@ -182,45 +300,21 @@ class Gamepad(QThread):
         Returns a boolean to identify if there has been a change.
         """
         changed = False
-        # Left stick
-        Lx = int(100 * self.axis_value(self.joystick.get_axis(self.gamepad_mapping["LEFT_STICK_X"])))
-        Ly = int(-100 * self.axis_value(self.joystick.get_axis(self.gamepad_mapping["LEFT_STICK_Y"])))
-        if Lx != self.rover_axis[0]:
-            self.rover_axis[0] = Lx
-            changed = True
-        if Ly != self.rover_axis[1]:
-            self.rover_axis[1] = Ly
-            changed = True
-
-        # Right stick
-        Rx = int(100 * self.axis_value(self.joystick.get_axis(self.gamepad_mapping["RIGHT_STICK_X"])))
-        Ry = int(-100 * self.axis_value(self.joystick.get_axis(self.gamepad_mapping["RIGHT_STICK_Y"])))
-        if Rx != self.rover_axis[3]:
-            self.rover_axis[3] = Rx
-            changed = True
-        if Ry != self.rover_axis[4]:
-            self.rover_axis[4] = Ry
-            changed = True
-
-        # Bumpers NOTE Does not reset correctly
-        # Multiply with 255 for JSON specification
-        value = int(255 * self.axis_value(self.joystick.get_axis(self.gamepad_mapping["BUMPERS"])))
-        # Left bumper
-        if value > 0:
-            self.rover_axis[2] = value
-            changed = True
-        # Right bumper
-        elif value < 0:
-            self.rover_axis[5] = value
-            changed = True
-
-        elif value == 0:
-            self.rover_axis[2] = 0
-            self.rover_axis[5] = 0
+        # Sticks, one pass over the compiled indices + lookup tables.
+        for axis, value in zip(self.profile.stickAxes, self.profile.readSticks(self.joystick)):
+            if value != self.rover_axis[axis]:
+                self.rover_axis[axis] = value
+                changed = True
+
+        # Bumpers share one axis, positive is the left one.
+        value = self.profile.readBumpers(self.joystick)
+        left, right = (value, self.rover_axis[5]) if value > 0 else ((self.rover_axis[2], value) if value < 0 else (0, 0))
+        if (left != self.rover_axis[2]) or (right != self.rover_axis[5]):
+            self.rover_axis[2], self.rover_axis[5] = left, right
             changed = True
 
         # D-pad
-        Dx, Dy = self.joystick.get_hat(0)
+        Dx, Dy = self.joystick.get_hat(self.profile.hat)
         if Dx != self.rover_axis[6]:
             self.rover_axis[6] = Dx # X
             changed = True
@@ -229,56 +323,134 @@ class Gamepad(QThread):
             changed = True
         return changed
 
+    def sendState(self, now):
+        """
+        Send the current state to the rover, as a delta when possible, otherwise as a full keyframe.
+        Called by the send scheduler, at a fixed rate.
+        """
+        # Only msgs. carrying a new input are stamped (acked), with the time of the input that changed the state.
+        seq = self.sendSeq if self.lastInputTime is not None else None
+        keyframe = (not self.useDelta) or ((now - self.lastKeyframeTime) >= self.keyframeInterval)
+        if keyframe:
+            message = gamepad_packet.encodeKeyframe(self.rover_axis, self.rover_buttons, seq, self.lastInputTime)
+            self.lastKeyframeTime = now
+        else:
+            message = gamepad_packet.encodeDelta(self.rover_axis, self.rover_buttons, self.lastSentAxis, self.lastSentButtons, seq, self.lastInputTime)
+            if message is None:
+                return
+
+        if seq is not None:
+            self.sendSeq += 1
+        self.lastInputTime = None
+        self.lastSentAxis = dict(self.rover_axis)
+        self.lastSentButtons = dict(self.rover_buttons)
+        # A keyframe supersedes every older gamepad msg., deltas have to be sent in order.
+        UDP.ROVERSERVER.writeToRover(message, UDP.COMMAND_KEY_GAMEPAD if keyframe else None, UDP.COMMAND_PRIORITY_STREAM)
+
+    def recordSendTick(self, tick):
+        """
+        Measure how far the actual send interval deviates from the configured send period.
+        """
+        if self.lastSendTick is not None:
+            deviation = abs((tick - self.lastSendTick) - self.sendPeriod)
+            self.sendJitter += (deviation - self.sendJitter) * GAMEPAD_JITTER_GAIN
+            self.maxSendJitter = maxVal(self.maxSendJitter, deviation)
+        self.lastSendTick = tick
+        self.sendCount += 1
+
+    def getSendStatistics(self):
+        """
+        Returns the send rate + jitter (sec.) of the send scheduler.
+        """
+        return {
+            "rate": 1 / self.sendPeriod,
+            "sent": self.sendCount,
+            "jitter": self.sendJitter,
+            "maxJitter": self.maxSendJitter
+        }
+
     # NOTE create a local variable to hold the gamepad value for the functions
     # we
     # will use.
     # Initializes pygame and creates a instance of a clock to control the tick
     # rate.
     def run(self):
-        CLOCK = pygameTime.Clock()
         self.refresh() # Startup Gamepad.
         lastEventTime = time.time()
+        nextSend = time.perf_counter()
  
         while self.shouldDestroy == False:
             now = time.time()
-            if self.needRefresh: # User wants to check for newly connected or disconnected gamepad, reinits list + gamepads stuff.
+            self.handleRecordingRequests()
+            if self.needRefresh and not self.replay: # User wants to check for newly connected or disconnected gamepad, reinits list + gamepads stuff.
+                start = time.perf_counter()
                 self.refresh()
+                self.recordRefreshLatency(start)
                 self.needRefresh = False
                 lastEventTime = now
                 continue
 
-            if self.joystick_id_switch >= 0: # User wants to select a different gamepad!
+            if self.joystick_id_switch >= 0 and not self.replay: # User wants to select a different gamepad!
                 self.initialize(self.joystick_id_switch)
                 self.joystick_id_switch = -1
                 continue
                 
-            # Go through the event list and find button, axis and hat events
+            # Sample input: go through the event list and find button, axis and hat events, the state is read once per sample.
+            buttonsChanged, axisChanged = False, False
             for EVENT in event.get():
-                eventHappened = False
+                if self.recorder and self.joystick:
+                    getInstanceId = getattr(self.joystick, "get_instance_id", None) # pygame 2+ only.
+                    self.recorder.record(EVENT, getInstanceId() if getInstanceId else None)
                 if EVENT.type == JOYBUTTONDOWN or EVENT.type == JOYBUTTONUP:
-                    self.read_rover_buttons()
-                    eventHappened = True
+                    buttonsChanged = True
+                elif EVENT.type == JOYAXISMOTION or EVENT.type == JOYHATMOTION:
+                    axisChanged = True
+                elif GAMEPAD_HOTPLUG and (EVENT.type == JOYDEVICEADDED or EVENT.type == JOYDEVICEREMOVED):
+                    start = time.perf_counter()
+                    self.hotplug(EVENT)
+                    self.recordRefreshLatency(start)
+
+            # While replaying, the recorded events replace the physical controller.
+            # As fast as possible replays are stepped once per send, so what is sent never depends on timing.
+            tick = time.perf_counter()
+            sendDue = (tick >= nextSend)
+            if self.replay:
+                buttonsChanged, axisChanged = self.replay.poll(time.monotonic()) if ((self.replay.speed > 0) or sendDue) else (False, False)
 
-                if EVENT.type == JOYAXISMOTION or EVENT.type == JOYHATMOTION:
-                    if self.read_rover_axis():
-                        eventHappened = True
-                
-                if eventHappened:
+            if self.joystick:
+                if buttonsChanged:
+                    self.read_rover_buttons()
+                    lastEventTime = now
+                if axisChanged and self.read_rover_axis():
                     lastEventTime = now
-                    message = {
-                        "Axis" : self.rover_axis,
-                        "Buttons" : self.rover_buttons
-                    }
-                    print(message)
-                    UDP.ROVERSERVER.writeToRover(json.dumps(message, separators=(',', ':')))
+                if (buttonsChanged or axisChanged) and self.lastInputTime is None:
+                    self.lastInputTime = time.monotonic()
+
+            # Transmit the latest state at a fixed rate, independent of how many events arrived.
+            if sendDue:
+                if self.joystick:
+                    self.recordSendTick(tick)
+                    self.sendState(self.replayClock() if (self.replay and self.replay.speed <= 0) else now)
+                else:
+                    self.lastSendTick = None
+                if self.replay and self.replay.finished(): # Last recorded state has been sent.
+                    self.finishReplay()
+                nextSend += self.sendPeriod
+                if nextSend < tick: # Fell behind, skip the missed sends instead of bursting.
+                    nextSend = tick + self.sendPeriod
             
-            if (now - lastEventTime) >= (GAMEPAD_REFRESH_INTERVAL_CONNECTED if (joystick and (joystick.get_count() > 0)) else GAMEPAD_REFRESH_INTERVAL_DISCONNECTED):
+            # Without hotplug events, look for a controller periodically, but only while none is active, so an idle controller is never re-initialized.
+            if not GAMEPAD_HOTPLUG and (self.joystick is None) and ((now - lastEventTime) >= GAMEPAD_REFRESH_INTERVAL_DISCONNECTED):
+                start = time.perf_counter()
                 self.refresh()
+                self.recordRefreshLatency(start)
                 lastEventTime = now
 
-            # Limit the clock rate to 30 ticks per second
-            CLOCK.tick(30)
+            # Sleep until the next send is due, but keep sampling input in between.
+            time.sleep(clamp(nextSend - time.perf_counter(), 0, GAMEPAD_POLL_INTERVAL))
 
+        if self.recorder:
+            self.recorder.close()
         quit()
 
 def loadGamepad():
@@ -0,0 +1,150 @@
+""" Controller mapping profiles, compiled into index arrays + lookup tables when a controller is selected """
+
+import os
+from configparser import ConfigParser
+
+PROFILE_FILE = "gamepads.ini"
+PROFILE_DEFAULT = "Xbox"
+PROFILE_RESOLUTION = 1000 # Lookup table entries per unit of raw axis value.
+
+# Rover button order, None is never pressed (XBOX button).
+ROVER_BUTTONS = ("A", "B", "Y", "X", "LB", "RB", "START", "BACK", None, "LEFT_STICK_BUTTON", "RIGHT_STICK_BUTTON")
+# Rover stick axes as (rover axis, control, scale), the y axes are flipped to correspond to the json specification.
+ROVER_STICKS = ((0, "LEFT_STICK_X", 100), (1, "LEFT_STICK_Y", -100), (3, "RIGHT_STICK_X", 100), (4, "RIGHT_STICK_Y", -100))
+ROVER_BUMPER_SCALE = 255 # Multiply with 255 for JSON specification.
+
+# Xbox controller, pygame on Windows. Bumpers (triggers) share one axis, positive for the left one.
+DEFAULT_PROFILE = {
+    "match": "Xbox", # Used for controllers whose name contains this, case insensitive.
+    "deadzone": "0.1",
+    "curve": "1.0", # Exponent applied after the deadzone, 1 is linear.
+    "A": "0",
+    "B": "1",
+    "X": "2",
+    "Y": "3",
+    "LB": "4",
+    "RB": "5",
+    "BACK": "6",
+    "START": "7",
+    "LEFT_STICK_BUTTON": "8",
+    "RIGHT_STICK_BUTTON": "9",
+    "LEFT_STICK_X": "0",
+    "LEFT_STICK_Y": "1",
+    "BUMPERS": "2",
+    "RIGHT_STICK_Y": "3",
+    "RIGHT_STICK_X": "4",
+    "HAT": "0"
+}
+
+PROFILES = dict()
+
+def loadProfiles():
+    """
+    Load the mapping profiles, creates gamepads.ini with the default profile if not found.
+    """
+    global PROFILES
+    config = ConfigParser()
+    config.optionxform = str # Control names are upper case.
+    PROFILES = {PROFILE_DEFAULT: dict(DEFAULT_PROFILE)}
+    try:
+        if not os.path.exists(PROFILE_FILE):
+            config[PROFILE_DEFAULT] = DEFAULT_PROFILE
+            with open(PROFILE_FILE, "w") as configfile:
+                config.write(configfile)
+        else:
+            config.read(PROFILE_FILE)
+
+        for k, v in config.items():
+            if k == "DEFAULT":
+                continue
+            profile = dict(DEFAULT_PROFILE) # Anything not given falls back to the default layout.
+            profile.update(v)
+            PROFILES[k] = profile
+    except Exception as e:
+        print("Unable to read/create {}, {}".format(PROFILE_FILE, e))
+
+    return PROFILES
+
+def findProfile(name, forced=""):
+    """
+    Returns the name of the profile to use for a controller, a forced profile wins over matching by controller name.
+    """
+    if forced in PROFILES:
+        return forced
+
+    name = name.lower()
+    for k, v in PROFILES.items():
+        match = v.get("match", "").lower()
+        if match and (match in name):
+            return k
+    return PROFILE_DEFAULT
+
+def deadzoneCurve(value, deadzone, curve):
+    """
+    Deadzone calculations, rescales everything outside the deadzone to 0 - 1 and snaps to full deflection above 0.95
+    created by joncoop at github, see controller/gamepad.py
+    """
+    if value > deadzone:
+        newValue = (value - deadzone) / (1 - deadzone)
+        return 1 if newValue > 0.95 else newValue ** curve
+    elif value < -deadzone:
+        newValue = (value + deadzone) / (1 - deadzone)
+        return -1 if newValue < -0.95 else -((-newValue) ** curve)
+    return 0
+
+def buildTable(deadzone, curve, scale):
+    """
+    Output value for every raw axis value from -1 to 1, in steps of 1 / PROFILE_RESOLUTION.
+    """
+    return tuple(int(scale * deadzoneCurve(i / PROFILE_RESOLUTION, deadzone, curve)) for i in range(-PROFILE_RESOLUTION, PROFILE_RESOLUTION + 1))
+
+def lookupIndex(value):
+    """
+    Lookup table index of a raw axis value, clamped to -1 - 1.
+    """
+    i = int(round(value * PROFILE_RESOLUTION))
+    if i > PROFILE_RESOLUTION:
+        return PROFILE_RESOLUTION * 2
+    if i < -PROFILE_RESOLUTION:
+        return 0
+    return i + PROFILE_RESOLUTION
+
+class CompiledProfile():
+    """
+    A profile resolved into raw button + axis indices and lookup tables, so a read is a single pass without any name lookups or deadzone math.
+    """
+    def __init__(self, name, profile):
+        self.name = name
+        self.deadzone = float(profile["deadzone"])
+        self.curve = float(profile["curve"])
+        self.buttons = tuple((int(profile[b]) if b else -1) for b in ROVER_BUTTONS)
+        self.stickAxes = tuple(s[0] for s in ROVER_STICKS)
+        self.stickIndices = tuple(int(profile[s[1]]) for s in ROVER_STICKS)
+        self.stickTables = tuple(buildTable(self.deadzone, self.curve, s[2]) for s in ROVER_STICKS)
+        self.bumpers = int(profile["BUMPERS"])
+        self.bumperTable = buildTable(self.deadzone, self.curve, ROVER_BUMPER_SCALE)
+        self.hat = int(profile["HAT"])
+
+    def readButtons(self, joystick):
+        get = joystick.get_button
+        return [(i >= 0) and bool(get(i)) for i in self.buttons]
+
+    def readSticks(self, joystick):
+        get = joystick.get_axis
+        return [table[lookupIndex(get(i))] for i, table in zip(self.stickIndices, self.stickTables)]
+
+    def readBumpers(self, joystick):
+        return self.bumperTable[lookupIndex(joystick.get_axis(self.bumpers))]
+
+def compileProfile(name, deadzone=None):
+    """
+    Compile a loaded profile, falls back to the default profile if it is invalid.
+    """
+    profile = dict(PROFILES.get(name, DEFAULT_PROFILE))
+    if deadzone is not None:
+        profile["deadzone"] = deadzone
+    try:
+        return CompiledProfile(name, profile)
+    except (KeyError, ValueError) as e:
+        print("Invalid gamepad profile {}, {}".format(name, e))
+        return CompiledProfile(PROFILE_DEFAULT, DEFAULT_PROFILE)
@@ -0,0 +1,134 @@
+""" Recording + deterministic replay of raw gamepad input, replays run through the same pipeline as a physical controller """
+
+import json
+import time
+
+from pygame import JOYBUTTONDOWN, JOYAXISMOTION, JOYHATMOTION, JOYBUTTONUP
+
+RECORDING_VERSION = 1
+
+class InputRecorder():
+    """
+    Writes every axis, button and hat event of the active controller as one json line, with the time in sec. since the recording started.
+    Line buffered, so a crash loses at most the event being written.
+    """
+    def __init__(self, path, name=""):
+        self.file = open(path, "w", buffering=1)
+        self.file.write(json.dumps({"version": RECORDING_VERSION, "name": name}) + "\n") # Controller name, to replay with the same mapping profile.
+        self.start = time.monotonic()
+        self.events = 0
+
+    def __del__(self):
+        self.close()
+
+    def record(self, e, instanceId):
+        """
+        Record an event, events of other controllers than instanceId are left out.
+        Every event is recorded when instanceId is None (pygame 1 has no instance ids).
+        """
+        if (instanceId is not None) and (getattr(e, "instance_id", instanceId) != instanceId):
+            return
+
+        if e.type == JOYAXISMOTION:
+            line = {"type": "axis", "index": e.axis, "value": e.value}
+        elif e.type == JOYBUTTONDOWN or e.type == JOYBUTTONUP:
+            line = {"type": "button", "index": e.button, "value": int(e.type == JOYBUTTONDOWN)}
+        elif e.type == JOYHATMOTION:
+            line = {"type": "hat", "index": e.hat, "value": list(e.value)}
+        else:
+            return
+
+        line["t"] = time.monotonic() - self.start
+        self.file.write(json.dumps(line, separators=(',', ':')) + "\n")
+        self.events += 1
+
+    def close(self):
+        if self.file:
+            self.file.close()
+            self.file = None
+
+class VirtualJoystick():
+    """
+    Stands in for a pygame joystick during a replay, exposes the parts of the joystick API the gamepad reads.
+    """
+    def __init__(self, name="Replay"):
+        self.name = name
+        self.axes = dict()
+        self.buttons = dict()
+        self.hats = dict()
+
+    def apply(self, line):
+        if line["type"] == "axis":
+            self.axes[line["index"]] = line["value"]
+        elif line["type"] == "button":
+            self.buttons[line["index"]] = line["value"]
+        elif line["type"] == "hat":
+            self.hats[line["index"]] = tuple(line["value"])
+
+    def get_axis(self, i):
+        return self.axes.get(i, 0.0)
+
+    def get_button(self, i):
+        return self.buttons.get(i, 0)
+
+    def get_hat(self, i):
+        return self.hats.get(i, (0, 0))
+
+    def get_name(self):
+        return self.name
+
+    def get_init(self):
+        return True
+
+    def get_instance_id(self):
+        return -1
+
+    def init(self):
+        pass
+
+    def quit(self):
+        pass
+
+class InputReplay():
+    """
+    Replays a recording with the original timing scaled by speed, or as fast as possible (speed = 0), one event per poll.
+    The gamepad polls an as fast as possible replay once per send, so every recorded event is sent exactly once.
+    """
+    def __init__(self, path, speed=1.0):
+        with open(path, "r") as f:
+            header = json.loads(f.readline())
+            if header.get("version") != RECORDING_VERSION:
+                raise ValueError("{} is not a supported gamepad recording!".format(path))
+            self.lines = [json.loads(l) for l in f if l.strip()]
+
+        self.speed = speed
+        self.joystick = VirtualJoystick(header.get("name") or "Replay")
+        self.position = 0
+        self.start = None
+
+    def finished(self):
+        return self.position >= len(self.lines)
+
+    def poll(self, now):
+        """
+        Apply every event which is due to the virtual joystick, returns (buttons changed, axis changed).
+        """
+        if self.start is None:
+            self.start = now
+
+        buttonsChanged, axisChanged = False, False
+        while not self.finished():
+            line = self.lines[self.position]
+            if self.speed > 0 and (self.start + (line["t"] / self.speed)) > now:
+                break
+
+            self.joystick.apply(line)
+            if line["type"] == "button":
+                buttonsChanged = True
+            else:
+                axisChanged = True
+            self.position += 1
+            if self.speed <= 0:
+                break
+
+        return buttonsChanged, axisChanged
@@ -21,12 +21,15 @@ from widgets.controlStationStatus import ControlStatus
 from widgets.speed import SpeedWidget
 from widgets.message import CustomMessageWidget
 from widgets.temperature import TemperatureWidget
+from widgets.commandLatency import CommandLatencyWidget
 
 from utils.warning import showWarning
 from communications import database
 from camera import video_window as vw
 from camera import video_manager as vm
 
+LINK_LOSS_WARNING = 10 # Warn when the packet loss % exceeds this.
+
 def getValueForDBEvent(e):
     try:
         return float(e.message)
@@ -57,6 +60,8 @@ class MainWindow(QMainWindow):
 
         database.SIGNAL.status.connect(self.changeDatabaseStatus)
         udp_conn.ROVERSERVER.communicationTimeout.connect(self.changeRoverStatus)
+        udp_conn.ROVERSERVER.linkStatistics.connect(self.changeLinkStatistics)
+        udp_conn.ROVERSERVER.commandLatency.connect(self.changeCommandLatency)
 
         udp_conn.ROVERSERVER.onReceiveData.connect(self.receivedDataFromRover)        
 
@@ -81,8 +86,10 @@ class MainWindow(QMainWindow):
         self.speed = SpeedWidget()
         self.message = CustomMessageWidget()
         self.temperature = TemperatureWidget()
+        self.commandLatency = CommandLatencyWidget()
         self.leftFrameGrid.addWidget(self.controlStatus, 0, 0)
         self.leftFrameGrid.addWidget(self.status, 1, 0)
+        self.leftFrameGrid.addWidget(self.commandLatency, 2, 0)
         self.topFrameGrid.addWidget(self.compass, 0, 0)
         self.topFrameGrid.addWidget(self.gyro, 1, 0)
         self.bottomFrameGrid.addWidget(self.speed, 0, 0)
@@ -107,6 +114,7 @@ class MainWindow(QMainWindow):
         "}")
 
         self.lastRoverStatus = False
+        self.lastLinkDegraded = False
         self.lastGamepadStatus = False
         self.lastDBStatus = (False, "")
 
@@ -153,6 +161,18 @@ class MainWindow(QMainWindow):
             self.log.logData("Lost connection to the rover!", logger.LOGGER_PRIORITY_WARNING)
         self.lastRoverStatus = status
 
+    @pyqtSlot(dict)
+    def changeLinkStatistics(self, stats):
+        self.controlStatus.setLinkStatistics(stats)
+        degraded = (stats["packets"] > 0) and (stats["loss"] >= LINK_LOSS_WARNING)
+        if degraded and not self.lastLinkDegraded:
+            self.log.logData("Rover link is degrading, {:.1f}% packet loss!".format(stats["loss"]), logger.LOGGER_PRIORITY_WARNING)
+        self.lastLinkDegraded = degraded
+
+    @pyqtSlot(dict)
+    def changeCommandLatency(self, snapshot):
+        self.commandLatency.setHistogram(snapshot)
+
     @pyqtSlot(tuple)
     def changeDatabaseStatus(self, status):
         self.controlStatus.setDatabaseStatus(status[0])
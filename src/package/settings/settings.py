@@ -28,7 +28,13 @@ DEFAULT_SECTIONS = ("main", "database", "communication")
 DEFAULT_MAIN_SETTINGS = {
     # Empty means no stylesheet, default look
     "stylesheet" : "False",
-    "multithread" : "False"
+    "multithread" : "False",
+    "multiprocess" : "False", # Decode every camera stream in its own process.
+    "recordingSegmentDuration" : "300", # Sec. per recording segment, 0 for no limit.
+    "recordingSegmentSize" : "1024", # MB per recording segment, 0 for no limit.
+    "replaySeconds" : "30", # Sec. of instant replay kept per camera (enabled per camera), 0 disables it everywhere.
+    "replayMemory" : "256", # MB of instant replay per camera.
+    "replayQuality" : "80" # JPEG quality of the instant replay frames.
 }
 DEFAULT_DATABASE_SETTINGS = {
     "address": "127.0.0.1",
@@ -36,7 +42,13 @@ DEFAULT_DATABASE_SETTINGS = {
     "db": "rover",
     "user": "postgres",
     "passwd": "xyz",
-    "type": "postgresql"
+    "type": "postgresql",
+    "writerBatchSize": "500",
+    "writerFlushInterval": "1.0",
+    "writerQueueSize": "10000",
+    "poolSize": "5",
+    "poolOverflow": "10",
+    "poolTimeout": "30"
 }
 DEFAULT_COMMUNICATION_SETTINGS = {
     "serverGamepadAddress" : "127.0.0.1",
@@ -45,7 +57,12 @@ DEFAULT_COMMUNICATION_SETTINGS = {
     "clientGamepadPort" : "37500",
     "comGamepadProtocol" : "True", # True - UDP, TCP otherwise.
     "serverRoverAddress" : "239.255.43.21", # Rover Broadcast Addr.
-    "serverRoverPort" : "45454"
+    "serverRoverPort" : "45454",
+    "displayRate" : "30", # Max UI updates per sec. with rover telemetry.
+    "gamepadDelta" : "False", # Only send changed axes + buttons, with periodic keyframes.
+    "gamepadKeyframeInterval" : "1.0",
+    "gamepadSendRate" : "50", # Gamepad state msgs. per sec.
+    "gamepadProfile" : "" # Mapping profile from gamepads.ini, empty picks one by controller name.
 }
 
 def loadSettings():
@@ -121,6 +138,7 @@ class OptionWindow(QDialog):
         # Threadmode - Multi threaded camera streams or synced on a single unique thread.
         self.threadSync.setChecked(not (SETTINGS.get("main", "multithread") == "True"))
         self.threadAsync.setChecked((SETTINGS.get("main", "multithread") == "True"))
+        self.threadProcess.setChecked((SETTINGS.get("main", "multiprocess", fallback="False") == "True"))
 
         # Database
         self.databaseAddress.setText(SETTINGS.get("database", "address"))
@@ -145,6 +163,7 @@ class OptionWindow(QDialog):
 
         # Warning        
         self.threadAsync.toggled.connect(lambda: RESTARTEVENT.raiseEvent(self))
+        self.threadProcess.toggled.connect(lambda: RESTARTEVENT.raiseEvent(self))
 
     def saveSettings(self):
         """
@@ -156,6 +175,7 @@ class OptionWindow(QDialog):
         # Main
         SETTINGS.set("main", "stylesheet", str(self.checkBox_dark.isChecked()))
         SETTINGS.set("main", "multithread", str(not self.threadSync.isChecked()))
+        SETTINGS.set("main", "multiprocess", str(self.threadProcess.isChecked()))
 
         # Database
         SETTINGS.set("database", "address", str(self.databaseAddress.text()))
@@ -0,0 +1,59 @@
+""" Live histogram of the round-trip time from gamepad input to the rover's acknowledgement """
+
+from PyQt5.QtWidgets import QWidget, QSizePolicy, QFileDialog
+from PyQt5.uic import loadUi
+from matplotlib.backends.backend_qt5agg import FigureCanvasQTAgg as FigureCanvas
+from matplotlib.figure import Figure
+
+from communications import command_latency
+from communications import udp_conn as UDP
+from settings.settings import SETTINGS
+from widgets import logger as log
+
+class CommandLatencyWidget(QWidget):
+    def __init__(self):
+        super().__init__()
+        loadUi("designer/widget_commandLatency.ui", self)
+        self.snapshot = None
+
+        fig = Figure(figsize=(4, 1.5), dpi=100)
+        fig.patch.set_facecolor("None") # Make background transparent.
+        self.canvas = FigureCanvas(fig)
+        self.canvas.setSizePolicy(QSizePolicy.Expanding, QSizePolicy.Expanding)
+        self.canvas.setStyleSheet("background-color:transparent;")
+        self.layout_histogram.addWidget(self.canvas)
+
+        self.button_export.clicked.connect(self.export)
+        self.button_reset.clicked.connect(UDP.ROVERSERVER.clearCommandLatency)
+
+    def setHistogram(self, snapshot):
+        self.snapshot = snapshot
+        if snapshot["count"] <= 0:
+            self.label_summary.setText("No acks received")
+        else:
+            self.label_summary.setText("n={}  mean {:.1f} ms  p50 {:.1f}  p95 {:.1f}  p99 {:.1f}  max {:.1f}".format(
+                snapshot["count"], snapshot["mean"], snapshot["p50"], snapshot["p95"], snapshot["p99"], snapshot["max"]))
+
+        color = 'black' if (SETTINGS.get("main", "stylesheet") == "False") else 'white'
+        self.canvas.figure.clear()
+        ax = self.canvas.figure.add_subplot(111)
+        labels = command_latency.getBucketLabels(snapshot)
+        ax.bar(range(len(labels)), snapshot["counts"], color='r')
+        ax.set_xticks(range(len(labels)))
+        ax.set_xticklabels(labels, fontsize=6)
+        ax.tick_params(axis='x', colors=color)
+        ax.tick_params(axis='y', colors=color, labelsize=6)
+        ax.patch.set_alpha(0.0)
+        self.canvas.draw()
+
+    def export(self):
+        """Save the latest histogram as a csv file."""
+        if self.snapshot is None:
+            return
+
+        fileName, _ = QFileDialog.getSaveFileName(self.window(), "Export command latency", "", "CSV Files (*.csv);;All Files (*)", options=(QFileDialog.Options() | QFileDialog.DontUseNativeDialog))
+        if fileName:
+            try:
+                command_latency.exportCsv(self.snapshot, fileName)
+            except Exception as e:
+                log.LOGGER_EVENTS.dispatchDirectLogEvent(e, log.LOGGER_PRIORITY_ERROR)
@@ -21,4 +21,12 @@ class ControlStatus(QWidget):
         self.label_controller_status.setPixmap(self.iconOn.pixmap(QSize(64,64)) if status else self.iconOff.pixmap(QSize(64,64)))
     
     def setDatabaseStatus(self, status):
-        self.label_database_status.setPixmap(self.iconOn.pixmap(QSize(64,64)) if status else self.iconOff.pixmap(QSize(64,64)))
\ No newline at end of file
+        self.label_database_status.setPixmap(self.iconOn.pixmap(QSize(64,64)) if status else self.iconOff.pixmap(QSize(64,64)))
+
+    def setLinkStatistics(self, stats):
+        if stats["packets"] <= 0:
+            self.label_link_statistics.setText("Link: no sequenced packets")
+            return
+
+        self.label_link_statistics.setText("Loss: {:.1f}%  Reorder: {:.1f}%  Jitter: {:.1f} ms  Latency: {:.1f} ms".format(
+            stats["loss"], stats["reordered"], stats["jitter"], stats["latency"]))
\ No newline at end of file
@@ -40,7 +40,7 @@ class CustomMessageWidget(QWidget):
             return
 
         self.label_error.setText("")
-        UDP.ROVERSERVER.writeToRover(json.dumps({key: value}, separators=(',', ':')))
+        UDP.ROVERSERVER.writeToRover(json.dumps({key: value}, separators=(',', ':')), priority=UDP.COMMAND_PRIORITY_CRITICAL)
         
     def populateMessageButtons(self):
         """ Clear and populate the button box from the messages.ini in order """
@@ -55,4 +55,4 @@ class MotionControlWidget(QWidget):
         control = {"speed" : self.speed if self.mode == 0 else 0, "turn" : self.turn if self.mode == 0 else 0}
         manip = {"mode" : self.mode}
         message = {"manip" : manip, "control" : control}
-        UDP.ROVERSERVER.writeToRover(json.dumps(message, separators=(',', ':')))    
\ No newline at end of file
+        UDP.ROVERSERVER.writeToRover(json.dumps(message, separators=(',', ':')), priority=UDP.COMMAND_PRIORITY_CRITICAL)    
\ No newline at end of file